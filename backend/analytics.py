@@ -0,0 +1,147 @@
+import os
+import asyncio
+import argparse
+from collections import defaultdict
+
+import codec
+from conversations import index_key
+from topics import extract_topic
+
+RECENT_LIMIT = int(os.getenv("ANALYTICS_RECENT_LIMIT", "20"))
+PASS_SCORE = 60
+
+
+def summary_key(user_id: str) -> str:
+    return f"analytics:{user_id}"
+
+
+def topics_key(user_id: str) -> str:
+    return f"analytics_topics:{user_id}"
+
+
+def recent_key(user_id: str) -> str:
+    return f"analytics_recent:{user_id}"
+
+
+def result_summary(assessment_id: str, result: dict) -> str:
+    return codec.dumps({
+        "assessment_id": assessment_id,
+        "score": result.get("score", 0),
+        "pass_status": result.get("pass_status"),
+        "correct_answers": result.get("correct_answers"),
+        "total_questions": result.get("total_questions"),
+        "topic": result.get("topic"),
+        "timestamp": result.get("timestamp", 0),
+    }, sort_keys=True)
+
+
+def queue_result(pipe, user_id: str, assessment_id: str, result: dict):
+    score = int(result.get("score", 0))
+    pipe.hincrby(summary_key(user_id), "count", 1)
+    pipe.hincrby(summary_key(user_id), "score_sum", score)
+    pipe.hincrby(summary_key(user_id), "pass_count", 1 if score >= PASS_SCORE else 0)
+    if result.get("topic"):
+        pipe.sadd(topics_key(user_id), result["topic"])
+    pipe.zadd(recent_key(user_id), {result_summary(assessment_id, result): result.get("timestamp", 0)})
+    pipe.zremrangebyrank(recent_key(user_id), 0, -RECENT_LIMIT - 1)
+
+
+async def record_result(rdb, user_id: str, assessment_id: str, result: dict, ttl: int = 3600) -> bool:
+    """Store a graded result and count it; False if the assessment was already graded, which changes nothing."""
+    if not await rdb.set(f"assessment_result:{user_id}:{assessment_id}", codec.dumps(result), ex=ttl, nx=True):
+        return False
+    async with rdb.pipeline(transaction=True) as pipe:
+        queue_result(pipe, user_id, assessment_id, result)
+        await pipe.execute()
+    return True
+
+
+async def record_topic(rdb, user_id: str, topic: str):
+    await rdb.sadd(topics_key(user_id), topic)
+
+
+async def read_analytics(rdb, user_id: str) -> dict:
+    async with rdb.pipeline(transaction=False) as pipe:
+        pipe.hgetall(summary_key(user_id))
+        pipe.smembers(topics_key(user_id))
+        pipe.zrevrange(recent_key(user_id), 0, 4)
+        pipe.zcard(index_key(user_id))
+        summary, topics, recent, total_lessons = await pipe.execute()
+
+    assessments_taken = int(summary.get("count", 0))
+    score_sum = int(summary.get("score_sum", 0))
+    pass_count = int(summary.get("pass_count", 0))
+
+    return {
+        "total_lessons": total_lessons,
+        "assessments_taken": assessments_taken,
+        "average_score": round(score_sum / assessments_taken, 1) if assessments_taken else 0,
+        "topics_studied": sorted(topics),
+        "recent_assessments": [codec.loads(item) for item in recent],
+        "pass_rate": round(pass_count / assessments_taken * 100, 1) if assessments_taken else 0,
+    }
+
+
+async def backfill(rdb, reset: bool = False) -> dict:
+    """Seed aggregates for users who have none yet from assessment results and stored conversations.
+
+    With reset=True every user's aggregates are deleted and rebuilt instead. That is lossy: assessment
+    results expire after an hour, so anything older survives only in the aggregates being replaced.
+    """
+    results = defaultdict(list)
+    async for key in rdb.scan_iter(match="assessment_result:*", count=1000):
+        _, user_id, assessment_id = key.split(":", 2)
+        data = await rdb.get(key)
+        if data:
+            results[user_id].append((assessment_id, codec.loads(data)))
+
+    topics = defaultdict(set)
+    async for key in rdb.scan_iter(match="user_conversations:*", count=1000):
+        data = await rdb.get(key)
+        if data:
+            topics[key.split(":", 1)[1]].update(extract_topic(conv.get("topic", "Unknown")) for conv in codec.loads(data))
+    async for key in rdb.scan_iter(match="conversation:*", count=1000):
+        topic = await rdb.hget(key, "topic")
+        if topic:
+            topics[key.split(":")[1]].add(extract_topic(topic))
+
+    users = sorted(set(results) | set(topics))
+    if not reset:
+        async with rdb.pipeline(transaction=False) as pipe:
+            for user_id in users:
+                pipe.exists(summary_key(user_id))
+            seeded = await pipe.execute()
+        users = [user_id for user_id, exists in zip(users, seeded) if not exists]
+    for user_id in users:
+        async with rdb.pipeline(transaction=True) as pipe:
+            if reset:
+                pipe.delete(summary_key(user_id), topics_key(user_id), recent_key(user_id))
+            for assessment_id, result in results.get(user_id, []):
+                queue_result(pipe, user_id, assessment_id, result)
+            if topics.get(user_id):
+                pipe.sadd(topics_key(user_id), *topics[user_id])
+            await pipe.execute()
+    return {"users": len(users), "results": sum(len(results.get(user_id, [])) for user_id in users)}
+
+
+async def _main(args):
+    import redis.asyncio as redis
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    rdb = redis.from_url(args.redis_url or os.getenv("REDIS_URL", "redis://localhost:6379"), decode_responses=True)
+    try:
+        report = await backfill(rdb, reset=args.reset)
+        print(f"Backfilled analytics for {report['users']} users from {report['results']} assessment results")
+    finally:
+        await rdb.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed per-user analytics aggregates from existing Redis keys")
+    parser.add_argument("command", choices=["backfill"])
+    parser.add_argument("--reset", action="store_true",
+                        help="delete and rebuild users that already have aggregates; lossy, since assessment "
+                             "results expire after an hour")
+    parser.add_argument("--redis-url", default=None)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from topics import request_key
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache_key_corpus.jsonl")
+
+
+def load_corpus(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check which request pairs share a lesson cache key")
+    parser.add_argument("--corpus", default=CORPUS)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    misses = []
+    for pair in corpus:
+        shared = request_key(pair["a"]) == request_key(pair["b"])
+        if shared != pair["shared"]:
+            misses.append((pair, request_key(pair["a"]), request_key(pair["b"])))
+
+    print(f"Pairs keyed as expected: {len(corpus) - len(misses)}/{len(corpus)}")
+    for pair, key_a, key_b in misses:
+        expected = "share" if pair["shared"] else "differ"
+        print(f"  {pair['a']!r} ({key_a}) and {pair['b']!r} ({key_b}) should {expected}")
+    if misses:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import codec
+from grading import grade_assessment
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def sample_assessment(count: int = 3) -> dict:
+    questions = []
+    for i in range(1, count + 1):
+        options = [f"A plausible but distinct answer option number {letter} for question {i}" for letter in "ABCD"]
+        questions.append({
+            "id": f"q{i}",
+            "question": f"Which statement best describes how photosynthesis converts light energy in step {i}?",
+            "options": options,
+            "correct_answer": options[i % 4],
+        })
+    return {"id": str(uuid.uuid4()), "topic": "photosynthesis", "questions": questions, "timestamp": str(int(time.time()))}
+
+
+def sample_result(assessment: dict) -> dict:
+    answers = {q["id"]: q["options"][0] for q in assessment["questions"]}
+    result = grade_assessment(assessment, answers)
+    for item in result["feedback"]:
+        item["explanation"] = ("Chlorophyll absorbs light in the thylakoid membranes, and that energy drives the "
+                               "light-dependent reactions that produce ATP and NADPH for the Calvin cycle.")
+    return result
+
+
+def formats():
+    entries = [
+        ("stdlib json", lambda obj: json.dumps(obj), json.loads),
+        (f"codec {codec.JsonCodec.tag}", codec.CODECS[codec.JsonCodec.tag].encode, codec.loads),
+        ("frame", codec.encode_frame, codec.decode_frame),
+    ]
+    if msgpack is not None:
+        # Reference only: binary values do not fit the decode_responses=True pool.
+        entries.append(("msgpack (reference)", msgpack.packb, msgpack.unpackb))
+    return entries
+
+
+def measure(encode, decode, obj, iterations: int):
+    data = encode(obj)
+    assert decode(data) == obj
+    start = time.perf_counter()
+    for _ in range(iterations):
+        encode(obj)
+    encode_time = (time.perf_counter() - start) / iterations
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode(data)
+    decode_time = (time.perf_counter() - start) / iterations
+    size = len(data.encode() if isinstance(data, str) else data)
+    return encode_time, decode_time, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode/decode time and stored bytes for Redis payload codecs")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    assessment = sample_assessment()
+    payloads = {"assessment": assessment, "assessment_result": sample_result(assessment),
+                "bank_question": assessment["questions"][0]}
+    print(f"orjson: {'yes' if codec.orjson is not None else 'no (stdlib fallback)'}")
+    for name, obj in payloads.items():
+        print(f"\n{name}")
+        print(f"   {'format':<22}{'encode us':>11}{'decode us':>11}{'bytes':>8}")
+        for label, encode, decode in formats():
+            encode_time, decode_time, size = measure(encode, decode, obj, args.iterations)
+            print(f"   {label:<22}{encode_time * 1e6:>11.2f}{decode_time * 1e6:>11.2f}{size:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from intent import classify
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_corpus.jsonl")
+
+
+def load_corpus(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and throughput of the local intent classifier")
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    misses = []
+    for example in corpus:
+        predicted = classify(example["text"]).name
+        if predicted != example["intent"]:
+            misses.append((example["text"], example["intent"], predicted))
+
+    accuracy = (len(corpus) - len(misses)) / len(corpus) * 100
+    print(f"Accuracy: {len(corpus) - len(misses)}/{len(corpus)} ({accuracy:.1f}%)")
+    for text, expected, predicted in misses:
+        print(f"  {text!r}: expected {expected}, got {predicted}")
+
+    texts = [example["text"] for example in corpus]
+    start = time.perf_counter()
+    for _ in range(args.iterations):
+        for text in texts:
+            classify(text)
+    elapsed = time.perf_counter() - start
+    total = args.iterations * len(texts)
+    print(f"Throughput: {total / elapsed:,.0f} classifications/sec ({elapsed / total * 1e6:.1f} us each)")
+
+
+if __name__ == "__main__":
+    main()
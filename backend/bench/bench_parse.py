@@ -0,0 +1,97 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grading import parse_explanations
+from llm_json import ItemStream
+from question_bank import parse_questions, validate_question
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_corpus.jsonl")
+
+
+def load_corpus(path: str):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def legacy_parse(kind: str, response: str) -> int:
+    """The fixed-slice fence stripping used before llm_json, with the same per-item validation."""
+    text = response.strip()
+    if text.startswith("```json"):
+        text = text[7:-3].strip()
+    elif text.startswith("```"):
+        text = text[3:-3].strip()
+    data = json.loads(text)
+    if kind == "questions":
+        return sum(1 for item in data["questions"] if validate_question(item))
+    return sum(1 for item in data.get("explanations", []) if isinstance(item, dict) and item.get("id") and item.get("explanation"))
+
+
+def tolerant_parse(kind: str, response: str) -> int:
+    parse = parse_questions if kind == "questions" else parse_explanations
+    return len(parse(response)[0])
+
+
+def count_or_zero(parse, kind: str, response: str) -> int:
+    try:
+        return parse(kind, response)
+    except Exception:
+        return 0
+
+
+def time_parse(parse, examples, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for example in examples:
+            count_or_zero(parse, example["kind"], example["response"])
+    return (time.perf_counter() - start) / (iterations * len(examples))
+
+
+def first_item_offset(response: str, chunk: int) -> float:
+    """Fraction of the response received when the streaming parser hands over its first valid question."""
+    stream = ItemStream()
+    for offset in range(0, len(response), chunk):
+        if any(validate_question(item) for item in stream.feed(response[offset:offset + chunk])):
+            return min(offset + chunk, len(response)) / len(response)
+    return 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recovery rate and cost of tolerant LLM JSON parsing vs fence slicing")
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--chunk", type=int, default=4, help="characters per streamed delta")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    print(f"{'case':<38}{'expect':>7}{'legacy':>8}{'tolerant':>10}")
+    totals = {"legacy": 0, "tolerant": 0}
+    misses = []
+    for example in corpus:
+        legacy = count_or_zero(legacy_parse, example["kind"], example["response"])
+        tolerant = count_or_zero(tolerant_parse, example["kind"], example["response"])
+        totals["legacy"] += legacy == example["expect"]
+        totals["tolerant"] += tolerant == example["expect"]
+        if tolerant != example["expect"]:
+            misses.append(example["name"])
+        print(f"{example['name']:<38}{example['expect']:>7}{legacy:>8}{tolerant:>10}")
+    print(f"\nMatching expectation: legacy {totals['legacy']}/{len(corpus)}, tolerant {totals['tolerant']}/{len(corpus)}")
+    for name in misses:
+        print(f"  tolerant parser missed {name}")
+
+    clean = [example for example in corpus if example["name"] in ("clean", "fenced_json", "explanations_clean")]
+    for label, parse in (("legacy", legacy_parse), ("tolerant", tolerant_parse)):
+        print(f"{label:<9} {time_parse(parse, clean, args.iterations) * 1e6:8.1f} us per well-formed response")
+
+    streamed = [example for example in corpus if example["kind"] == "questions" and example["expect"] >= 2]
+    offsets = sorted(first_item_offset(example["response"], args.chunk) for example in streamed)
+    print(f"First streamed question ready after {offsets[len(offsets) // 2] * 100:.0f}% of the response "
+          f"(median of {len(offsets)}, {args.chunk}-char deltas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+TOPICS = [
+    "photosynthesis", "gravity", "the water cycle", "fractions", "plate tectonics", "the french revolution",
+    "cell division", "supply and demand", "electric circuits", "the solar system", "chemical bonds", "probability",
+]
+
+
+class StepFailed(Exception):
+    pass
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(values: List[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": round(sum(values) / len(values), 4) if values else 0.0,
+        "p50": round(percentile(values, 0.50), 4),
+        "p95": round(percentile(values, 0.95), 4),
+        "p99": round(percentile(values, 0.99), 4),
+        "max": round(max(values), 4) if values else 0.0,
+    }
+
+
+class Session:
+    """One learner: lesson, start_assessment, submit_assessment, then the analytics page."""
+
+    def __init__(self, base_url: str, user_id: str, topic: str, stream: bool, feedback: bool,
+                 correct_rate: float, timeout: float, rng: random.Random):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.topic = topic
+        self.stream = stream
+        self.feedback = feedback
+        self.correct_rate = correct_rate
+        self.timeout = timeout
+        self.rng = rng
+        self.timings: Dict[str, float] = {}
+        self.messages = 0
+
+    async def _send(self, ws, message: dict):
+        self.messages += 1
+        await ws.send(json.dumps(message))
+
+    async def _until(self, ws, wanted: str, started: float, first_frame: Optional[str] = None) -> dict:
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise StepFailed(f"timed out waiting for {wanted}")
+            frame = json.loads(await asyncio.wait_for(ws.recv(), timeout=remaining))
+            kind = frame.get("type")
+            if kind == "ping":
+                await ws.send(json.dumps({"type": "pong", "ts": frame.get("ts")}))
+                continue
+            if first_frame and first_frame not in self.timings and kind in ("message", "message_delta", "message_done"):
+                self.timings[first_frame] = time.perf_counter() - started
+            if kind == "error":
+                raise StepFailed(f"error frame while waiting for {wanted}: {frame.get('content')}")
+            if kind == wanted:
+                return frame
+
+    async def run(self, http: httpx.AsyncClient):
+        ws_url = self.base_url.replace("http", "ws", 1) + f"/ws/tutor/{self.user_id}"
+        async with websockets.connect(ws_url, max_size=None, open_timeout=self.timeout) as ws:
+            started = time.perf_counter()
+            await self._send(ws, {"type": "chat_message", "message": f"Explain {self.topic}", "stream": self.stream})
+            offer = await self._until(ws, "assessment_offer", started, first_frame="lesson_first_frame")
+            self.timings["lesson"] = time.perf_counter() - started
+
+            started = time.perf_counter()
+            await self._send(ws, {"type": "start_assessment", "topic": offer["topic"]})
+            assessment = (await self._until(ws, "assessment", started))["assessment"]
+            self.timings["start_assessment"] = time.perf_counter() - started
+
+            answers = {}
+            for question in assessment["questions"]:
+                wrong = [option for option in question["options"] if option != question["correct_answer"]]
+                correct = self.rng.random() < self.correct_rate or not wrong
+                answers[question["id"]] = question["correct_answer"] if correct else self.rng.choice(wrong)
+            started = time.perf_counter()
+            await self._send(ws, {"type": "submit_assessment", "assessment_id": assessment["id"], "answers": answers,
+                                  "feedback": self.feedback})
+            await self._until(ws, "assessment_result", started)
+            self.timings["submit_assessment"] = time.perf_counter() - started
+            if self.feedback:
+                await self._until(ws, "assessment_feedback", started)
+                self.timings["assessment_feedback"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        response = await http.get(f"{self.base_url}/api/analytics/{self.user_id}")
+        if response.status_code != 200:
+            raise StepFailed(f"analytics returned {response.status_code}")
+        self.timings["analytics"] = time.perf_counter() - started
+
+
+async def run_load(base_url: str, sessions: int = 50, concurrency: int = 10, users: Optional[int] = None,
+                   topics: Optional[List[str]] = None, stream: bool = False, feedback: bool = True,
+                   correct_rate: float = 0.7, think_time: float = 0.0, timeout: float = 60.0, seed: int = 1) -> dict:
+    """Replay `sessions` learner sessions with at most `concurrency` in flight and summarize the latencies."""
+    rng = random.Random(seed)
+    topics = topics or TOPICS
+    users = users or sessions
+    gate = asyncio.Semaphore(concurrency)
+    steps = defaultdict(list)
+    errors = defaultdict(int)
+    totals = {"sessions": 0, "messages": 0}
+
+    async def one(index: int, http: httpx.AsyncClient):
+        async with gate:
+            if think_time:
+                await asyncio.sleep(rng.uniform(0, think_time))
+            session = Session(base_url, f"bench_{index % users}", rng.choice(topics), stream, feedback,
+                              correct_rate, timeout, random.Random(seed + index))
+            started = time.perf_counter()
+            try:
+                await session.run(http)
+            except StepFailed as e:
+                errors[str(e).split(":")[0]] += 1
+                return
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException, httpx.HTTPError) as e:
+                errors[type(e).__name__] += 1
+                return
+            finally:
+                totals["messages"] += session.messages
+            for step, value in session.timings.items():
+                steps[step].append(value)
+            steps["session"].append(time.perf_counter() - started)
+            totals["sessions"] += 1
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as http:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index, http) for index in range(sessions)))
+        duration = time.perf_counter() - started
+
+    return {
+        "sessions_ok": totals["sessions"],
+        "sessions_failed": sum(errors.values()),
+        "errors": dict(errors),
+        "duration": round(duration, 3),
+        "throughput": {
+            "sessions_per_sec": round(totals["sessions"] / duration, 3) if duration else 0.0,
+            "messages_per_sec": round(totals["messages"] / duration, 3) if duration else 0.0,
+        },
+        "latency": {step: summarize(values) for step, values in sorted(steps.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay learner sessions against a running backend")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--users", type=int, default=None)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--no-feedback", action="store_true")
+    parser.add_argument("--think-time", type=float, default=0.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    report = asyncio.run(run_load(args.url, args.sessions, args.concurrency, args.users, stream=args.stream,
+                                  feedback=not args.no_feedback, think_time=args.think_time, timeout=args.timeout))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
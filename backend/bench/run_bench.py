@@ -0,0 +1,233 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from loadgen import run_load
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# Each scenario gets a fresh stub LLM and a fresh backend process so memory and fd numbers are not shared.
+SCENARIOS: Dict[str, dict] = {
+    "smoke": {"sessions": 10, "concurrency": 5, "stream": False, "llm": {"latency": 0.05, "tokens_per_second": 2000}},
+    "baseline": {"sessions": 200, "concurrency": 50, "stream": False, "llm": {}},
+    "streaming": {"sessions": 200, "concurrency": 50, "stream": True, "llm": {}},
+    "burst": {"sessions": 500, "concurrency": 250, "stream": True, "llm": {}},
+    "slow_llm": {"sessions": 100, "concurrency": 50, "stream": True,
+                 "llm": {"latency": 2.0, "tokens_per_second": 40}},
+    "llm_errors": {"sessions": 200, "concurrency": 50, "stream": False, "llm": {"error_rate": 0.1}},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def process_stats(pid: int) -> dict:
+    """RSS, peak RSS and open descriptors from /proc; empty where /proc is unavailable."""
+    stats = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    stats[line.split(":")[0]] = int(line.split()[1]) / 1024
+        stats["fds"] = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        pass
+    return stats
+
+
+async def wait_until_up(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(timeout=5.0) as http:
+        while time.monotonic() < deadline:
+            try:
+                if (await http.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_stub(port: int, llm: dict) -> subprocess.Popen:
+    command = [sys.executable, os.path.join(BENCH_DIR, "stub_llm.py"), "--port", str(port)]
+    for name, value in llm.items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    return subprocess.Popen(command)
+
+
+def start_backend(port: int, stub_port: int, redis_url: str, env: Dict[str, str]) -> subprocess.Popen:
+    environment = {
+        **os.environ,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{stub_port}/v1",
+        "REDIS_URL": redis_url,
+        "REDIS_CONNECT_TIMEOUT": "0.5",
+        "REDIS_POOL_TIMEOUT": "0.5",
+        "LOG_LEVEL": "WARNING",
+        **env,
+    }
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning", "--no-access-log"]
+    return subprocess.Popen(command, cwd=BACKEND_DIR, env=environment)
+
+
+async def sample_process(pid: int, peaks: dict, interval: float = 0.25):
+    while True:
+        stats = process_stats(pid)
+        peaks["rss_peak_mb"] = max(peaks.get("rss_peak_mb", 0.0), stats.get("VmRSS", 0.0))
+        peaks["fds_peak"] = max(peaks.get("fds_peak", 0), stats.get("fds", 0))
+        await asyncio.sleep(interval)
+
+
+async def run_scenario(name: str, scenario: dict, redis_url: str, env: Dict[str, str]) -> dict:
+    stub_port, backend_port = free_port(), free_port()
+    stub = start_stub(stub_port, scenario.get("llm", {}))
+    backend = start_backend(backend_port, stub_port, redis_url, {**scenario.get("env", {}), **env})
+    base_url = f"http://127.0.0.1:{backend_port}"
+    try:
+        await wait_until_up(f"http://127.0.0.1:{stub_port}/stats")
+        await wait_until_up(f"{base_url}/health")
+        idle = process_stats(backend.pid)
+        peaks: dict = {}
+        sampler = asyncio.create_task(sample_process(backend.pid, peaks))
+        try:
+            report = await run_load(base_url, sessions=scenario["sessions"], concurrency=scenario["concurrency"],
+                                    users=scenario.get("users"), stream=scenario.get("stream", False),
+                                    feedback=scenario.get("feedback", True), think_time=scenario.get("think_time", 0.0))
+        finally:
+            sampler.cancel()
+        end = process_stats(backend.pid)
+        async with httpx.AsyncClient(timeout=5.0) as http:
+            llm_requests = (await http.get(f"http://127.0.0.1:{stub_port}/stats")).json()["requests"]
+    finally:
+        for process in (backend, stub):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report.update({
+        "scenario": name,
+        "config": scenario,
+        "llm_requests": llm_requests,
+        "process": {
+            "rss_idle_mb": round(idle.get("VmRSS", 0.0), 1),
+            "rss_end_mb": round(end.get("VmRSS", 0.0), 1),
+            "rss_peak_mb": round(max(peaks.get("rss_peak_mb", 0.0), end.get("VmHWM", 0.0)), 1),
+            "fds_idle": idle.get("fds"),
+            "fds_peak": max(peaks.get("fds_peak", 0), end.get("fds", 0)),
+            "fds_end": end.get("fds"),
+        },
+    })
+    return report
+
+
+def print_report(report: dict):
+    throughput = report["throughput"]
+    process = report["process"]
+    print(f"\n== {report['scenario']}: {report['sessions_ok']} ok, {report['sessions_failed']} failed "
+          f"in {report['duration']}s ({throughput['sessions_per_sec']} sessions/s, "
+          f"{throughput['messages_per_sec']} msgs/s, {report['llm_requests']} LLM calls)")
+    if report["errors"]:
+        print(f"   errors: {report['errors']}")
+    print(f"   memory: idle {process['rss_idle_mb']} MB, peak {process['rss_peak_mb']} MB, "
+          f"end {process['rss_end_mb']} MB; fds: idle {process['fds_idle']}, peak {process['fds_peak']}, "
+          f"end {process['fds_end']}")
+    print(f"   {'step':<22}{'count':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for step, stats in report["latency"].items():
+        print(f"   {step:<22}{stats['count']:>7}{stats['p50']:>9.3f}{stats['p95']:>9.3f}"
+              f"{stats['p99']:>9.3f}{stats['max']:>9.3f}")
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path) as f:
+        old = {report["scenario"]: report for report in json.load(f)["scenarios"]}
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old_path} -> {new_path}")
+    for report in new["scenarios"]:
+        before = old.get(report["scenario"])
+        if before is None:
+            continue
+        print(f"\n== {report['scenario']}")
+        rows = [("sessions/s", before["throughput"]["sessions_per_sec"], report["throughput"]["sessions_per_sec"]),
+                ("rss peak MB", before["process"]["rss_peak_mb"], report["process"]["rss_peak_mb"]),
+                ("failed", before["sessions_failed"], report["sessions_failed"])]
+        for step, stats in report["latency"].items():
+            if step in before["latency"]:
+                rows.append((f"{step} p95", before["latency"][step]["p95"], stats["p95"]))
+        for label, a, b in rows:
+            change = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+            print(f"   {label:<30}{a:>10}{b:>10}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline load benchmark against a stub LLM")
+    subcommands = parser.add_subparsers(dest="command")
+    run = subcommands.add_parser("run")
+    run.add_argument("scenarios", nargs="*", default=["smoke", "baseline", "streaming"],
+                     help=f"any of: {', '.join(SCENARIOS)}")
+    run.add_argument("--redis-url", default="redis://127.0.0.1:1",
+                     help="real Redis to use; the default is unreachable so the in-process fallback store is used")
+    run.add_argument("--env", action="append", default=[], help="extra backend environment, KEY=VALUE")
+    run.add_argument("--output", default=None)
+    diff = subcommands.add_parser("compare")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        compare(args.old, args.new)
+        return
+    if args.command is None:
+        args = parser.parse_args(["run"])
+
+    env = dict(item.split("=", 1) for item in args.env)
+    reports: List[dict] = []
+    for name in args.scenarios:
+        report = asyncio.run(run_scenario(name, SCENARIOS[name], args.redis_url, env))
+        print_report(report)
+        reports.append(report)
+
+    commit = git_commit()
+    created = datetime.now(timezone.utc)
+    output = args.output or os.path.join(RESULTS_DIR, f"{created:%Y%m%dT%H%M%S}-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "created": created.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "redis_url": args.redis_url,
+            "env": env,
+            "scenarios": reports,
+        }, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import re
+import json
+import random
+import asyncio
+import argparse
+import itertools
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("energy matter force system process example rule concept step result model structure change "
+         "balance pattern cycle reaction signal value").split()
+
+
+class StubSettings:
+    def __init__(self, latency: float = 0.3, jitter: float = 0.1, tokens_per_second: float = 200.0,
+                 lesson_tokens: int = 300, error_rate: float = 0.0, error_status: int = 503, seed: int = 7):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.lesson_tokens = lesson_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(seed)
+
+
+def lesson_text(settings: StubSettings, count: int) -> str:
+    return " ".join(settings.random.choice(WORDS) for _ in range(count)) + "."
+
+
+def questions_json(prompt: str, sequence: int) -> str:
+    match = re.search(r"Create (\d+) multiple choice questions", prompt)
+    count = int(match.group(1)) if match else 3
+    questions = []
+    for i in range(1, count + 1):
+        options = [f"option {sequence}-{i}-{letter}" for letter in "abcd"]
+        questions.append({"id": f"q{i}", "question": f"Stub question {sequence}-{i}?", "options": options,
+                          "correct_answer": options[i % 4]})
+    return "```json\n" + json.dumps({"questions": questions}, indent=2) + "\n```"
+
+
+def explanations_json(prompt: str) -> str:
+    ids = re.findall(r"Question id: (\S+)", prompt)
+    return json.dumps({"explanations": [{"id": qid, "explanation": f"Stub explanation for {qid}."} for qid in ids]})
+
+
+def create_app(settings: StubSettings) -> FastAPI:
+    app = FastAPI()
+    sequence = itertools.count(1)
+    app.state.requests = 0
+
+    def reply_for(prompt: str) -> str:
+        if prompt.startswith("Explain the correct answer"):
+            return explanations_json(prompt)
+        if "multiple choice questions about" in prompt:
+            return questions_json(prompt, next(sequence))
+        return lesson_text(settings, settings.lesson_tokens)
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        app.state.requests += 1
+        body = await request.json()
+        await asyncio.sleep(max(0.0, settings.latency + settings.random.uniform(-settings.jitter, settings.jitter)))
+        if settings.random.random() < settings.error_rate:
+            return JSONResponse({"error": {"message": "stub failure"}}, status_code=settings.error_status)
+
+        content = reply_for(body["messages"][-1]["content"])
+        tokens = re.findall(r"\S+\s*", content)
+        if not body.get("stream"):
+            await asyncio.sleep(len(tokens) / settings.tokens_per_second)
+            return {"choices": [{"message": {"role": "assistant", "content": content}}],
+                    "usage": {"completion_tokens": len(tokens)}}
+
+        async def events():
+            for token in tokens:
+                yield "data: " + json.dumps({"choices": [{"delta": {"content": token}}]}) + "\n\n"
+                await asyncio.sleep(1 / settings.tokens_per_second)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Stub chat-completions server for benchmarks")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--lesson-tokens", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+    settings = StubSettings(args.latency, args.jitter, args.tokens_per_second, args.lesson_tokens,
+                            args.error_rate, args.error_status)
+    uvicorn.run(create_app(settings), host="127.0.0.1", port=args.port, log_level="warning")
@@ -0,0 +1,148 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import codec
+from log import get_logger
+from tokens import count_tokens, truncate_to_tokens
+
+logger = get_logger(__name__)
+
+ROLE_LABELS = {"user": "Student", "tutor": "Tutor"}
+
+
+def turns_key(user_id: str) -> str:
+    return f"chat_context:{user_id}:turns"
+
+
+def summary_key(user_id: str) -> str:
+    return f"chat_context:{user_id}:summary"
+
+
+def render_turns(turns: List[dict]) -> str:
+    return "\n".join(f"{ROLE_LABELS.get(turn['role'], turn['role'])}: {turn['content']}" for turn in turns)
+
+
+class ChatContext:
+    """Per-user rolling context: recent turns verbatim, older turns folded into a running summary."""
+
+    def __init__(self, token_budget: int = 1500, summary_tokens: int = 300, ttl: int = 86400, lock_ttl: int = 120):
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self._compacting: Dict[str, asyncio.Task] = {}
+        self.stats = {"compactions": 0, "folded_turns": 0, "failures": 0}
+
+    @classmethod
+    def from_env(cls) -> "ChatContext":
+        return cls(
+            token_budget=int(os.getenv("CHAT_CONTEXT_TOKENS", "1500")),
+            summary_tokens=int(os.getenv("CHAT_SUMMARY_TOKENS", "300")),
+            ttl=int(os.getenv("CHAT_CONTEXT_TTL", "86400")),
+        )
+
+    @property
+    def verbatim_budget(self) -> int:
+        return self.token_budget - self.summary_tokens
+
+    async def append(self, rdb, user_id: str, turns: List[Tuple[str, str]]) -> List[dict]:
+        """Store (role, content) turns and return every turn not yet folded into the summary."""
+        now = int(time.time())
+        # No single turn may crowd the rest out of the window; a lesson is kept in part.
+        limit = self.verbatim_budget // 2
+        encoded = []
+        for role, content in turns:
+            content = truncate_to_tokens(content, limit)
+            encoded.append(codec.dumps({"role": role, "content": content, "tokens": count_tokens(content), "ts": now}))
+        async with rdb.pipeline(transaction=True) as pipe:
+            pipe.rpush(turns_key(user_id), *encoded)
+            pipe.expire(turns_key(user_id), self.ttl)
+            pipe.expire(summary_key(user_id), self.ttl)
+            pipe.lrange(turns_key(user_id), 0, -1)
+            results = await pipe.execute()
+        return [codec.loads(turn) for turn in results[-1]]
+
+    async def load(self, rdb, user_id: str) -> Tuple[str, List[dict]]:
+        async with rdb.pipeline(transaction=False) as pipe:
+            pipe.get(summary_key(user_id))
+            pipe.lrange(turns_key(user_id), 0, -1)
+            summary, turns = await pipe.execute()
+        return summary or "", [codec.loads(turn) for turn in turns]
+
+    def window(self, turns: List[dict]) -> List[dict]:
+        # Newest turns that fit; anything older is covered by the summary (or will be once compaction catches up).
+        kept, used = [], 0
+        for turn in reversed(turns):
+            if used + turn["tokens"] > self.verbatim_budget:
+                break
+            kept.append(turn)
+            used += turn["tokens"]
+        return kept[::-1]
+
+    def render(self, summary: str, turns: List[dict]) -> str:
+        parts = []
+        if summary:
+            parts.append(f"Summary of the earlier conversation:\n{truncate_to_tokens(summary, self.summary_tokens)}")
+        recent = self.window(turns)
+        if recent:
+            parts.append(f"Recent conversation:\n{render_turns(recent)}")
+        return "\n\n".join(parts)
+
+    async def prompt_context(self, rdb, user_id: str) -> str:
+        summary, turns = await self.load(rdb, user_id)
+        return self.render(summary, turns)
+
+    def needs_compaction(self, turns: List[dict]) -> bool:
+        return sum(turn["tokens"] for turn in turns) > self.verbatim_budget
+
+    async def compact(self, rdb, user_id: str, summarize: Callable[[str, List[dict]], Awaitable[str]]) -> int:
+        """Fold the oldest turns into the summary until the rest fill at most half the verbatim budget."""
+        lock_key = f"chat_context:{user_id}:lock"
+        if not await rdb.set(lock_key, "1", ex=self.lock_ttl, nx=True):
+            return 0
+        try:
+            summary, turns = await self.load(rdb, user_id)
+            remaining = sum(turn["tokens"] for turn in turns)
+            folded = 0
+            while folded < len(turns) and remaining > self.verbatim_budget // 2:
+                remaining -= turns[folded]["tokens"]
+                folded += 1
+            if not folded:
+                return 0
+            new_summary = await summarize(summary, turns[:folded])
+            async with rdb.pipeline(transaction=True) as pipe:
+                pipe.set(summary_key(user_id), new_summary, ex=self.ttl)
+                # Only compaction removes from the head, so turns appended meanwhile are kept.
+                pipe.ltrim(turns_key(user_id), folded, -1)
+                await pipe.execute()
+            self.stats["compactions"] += 1
+            self.stats["folded_turns"] += folded
+            return folded
+        finally:
+            await rdb.delete(lock_key)
+
+    def schedule_compaction(self, rdb, user_id: str, summarize: Callable[[str, List[dict]], Awaitable[str]]) -> Optional[asyncio.Task]:
+        if user_id in self._compacting:
+            return None
+        task = asyncio.create_task(self._compact_logged(rdb, user_id, summarize))
+        self._compacting[user_id] = task
+        task.add_done_callback(lambda t: self._compacting.pop(user_id, None))
+        return task
+
+    async def _compact_logged(self, rdb, user_id: str, summarize: Callable[[str, List[dict]], Awaitable[str]]):
+        try:
+            folded = await self.compact(rdb, user_id, summarize)
+            if folded:
+                logger.debug("Folded %d turns into the summary for %s", folded, user_id)
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.warning("Chat context compaction failed for %s: %s", user_id, e)
+
+    async def clear(self, rdb, user_id: str):
+        # A compaction still running here would write a summary of the turns being forgotten.
+        task = self._compacting.get(user_id)
+        if task is not None:
+            task.cancel()
+        await rdb.delete(turns_key(user_id), summary_key(user_id))
@@ -0,0 +1,76 @@
+import os
+import json
+from typing import Any, Dict, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _encode_json(obj: Any, sort_keys: bool = False) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode()
+    return json.dumps(obj, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False)
+
+
+def _decode_json(text: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+class JsonCodec:
+    """Compact JSON behind a version tag, e.g. 'j1:{"id":...}'."""
+
+    tag = "j1"
+
+    def encode(self, obj: Any, sort_keys: bool = False) -> str:
+        return f"{self.tag}:{_encode_json(obj, sort_keys)}"
+
+    def decode(self, body: str) -> Any:
+        return _decode_json(body)
+
+
+class PlainJsonCodec:
+    """Untagged JSON, readable by releases that predate the codec layer; use it while rolling out."""
+
+    tag = None
+
+    def encode(self, obj: Any, sort_keys: bool = False) -> str:
+        return _encode_json(obj, sort_keys)
+
+    def decode(self, body: str) -> Any:
+        return _decode_json(body)
+
+
+CODECS: Dict[Optional[str], Any] = {JsonCodec.tag: JsonCodec(), "json": PlainJsonCodec()}
+_TAGGED = {codec.tag: codec for codec in CODECS.values() if codec.tag}
+
+codec = CODECS[os.getenv("REDIS_CODEC", JsonCodec.tag)]
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> str:
+    """Encode a value for Redis with the configured codec."""
+    return codec.encode(obj, sort_keys)
+
+
+def loads(data: Optional[Union[str, bytes]]) -> Any:
+    """Decode a Redis value written by any codec, including untagged JSON from before the codec layer."""
+    if data is None:
+        return None
+    if isinstance(data, bytes):
+        data = data.decode()
+    tag, sep, body = data[:8].partition(":")
+    if sep and tag in _TAGGED:
+        return _TAGGED[tag].decode(data[len(tag) + 1:])
+    return _decode_json(data)
+
+
+def encode_frame(message: dict) -> str:
+    """WebSocket frames stay untagged JSON text; browsers parse them with JSON.parse."""
+    return _encode_json(message)
+
+
+def decode_frame(data: Union[str, bytes]) -> Any:
+    return _decode_json(data)
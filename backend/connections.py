@@ -0,0 +1,336 @@
+import os
+import time
+import uuid
+import asyncio
+import contextvars
+from collections import deque
+from typing import Dict, Optional
+from fastapi import WebSocket
+
+import codec
+from log import current_trace, get_logger
+from metrics import WS_CONNECTIONS, WS_EVICTIONS, WS_FRAMES_DROPPED, WS_QUEUED_BYTES, WS_REJECTED
+
+logger = get_logger(__name__)
+
+current_connection: contextvars.ContextVar = contextvars.ContextVar("current_connection", default=None)
+
+# Frames a slow client can lose without losing content: message_done repeats the streamed text.
+DROPPABLE_TYPES = {"message_delta", "typing", "ping"}
+
+CLOSE_TRY_AGAIN_LATER = 1013
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_GOING_AWAY = 1001
+
+
+def user_channel(user_id: str) -> str:
+    return f"ws:user:{user_id}"
+
+
+def presence_key(user_id: str) -> str:
+    return f"presence:{user_id}"
+
+
+class Outbox:
+    """Bounded queue of encoded frames for one socket, drained by its own writer task."""
+
+    def __init__(self, manager: "ConnectionManager", user_id: str, connection_id: str, websocket: WebSocket):
+        self.manager = manager
+        self.user_id = user_id
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.frames = deque()
+        self.queued_bytes = 0
+        self.ready = asyncio.Event()
+        self.last_seen = time.monotonic()
+        self.closing = False
+        self.writer = asyncio.create_task(self._write())
+
+    def _full(self, size: int) -> bool:
+        return len(self.frames) >= self.manager.outbox_frames or self.queued_bytes + size > self.manager.outbox_bytes
+
+    def _shed(self):
+        kept = deque(frame for frame in self.frames if not frame[1])
+        dropped = len(self.frames) - len(kept)
+        if dropped:
+            freed = sum(len(text) for text, droppable in self.frames if droppable)
+            self.frames = kept
+            self.queued_bytes -= freed
+            WS_QUEUED_BYTES.dec(amount=freed)
+            WS_FRAMES_DROPPED.inc("overflow", amount=dropped)
+
+    def put(self, text: str, droppable: bool) -> bool:
+        if self.closing:
+            return False
+        if self._full(len(text)):
+            if self.manager.slow_client_policy == "drop":
+                if droppable:
+                    WS_FRAMES_DROPPED.inc("overflow")
+                    return False
+                # Queued deltas are superseded by the frames that follow them; make room for this one.
+                self._shed()
+            if self._full(len(text)):
+                WS_FRAMES_DROPPED.inc("evicted")
+                self.manager.evict(self, "slow_consumer", CLOSE_TRY_AGAIN_LATER)
+                return False
+        self.frames.append((text, droppable))
+        self.queued_bytes += len(text)
+        WS_QUEUED_BYTES.inc(amount=len(text))
+        self.ready.set()
+        return True
+
+    def _discard(self):
+        WS_QUEUED_BYTES.dec(amount=self.queued_bytes)
+        self.frames.clear()
+        self.queued_bytes = 0
+
+    async def _write(self):
+        while True:
+            while not self.frames:
+                self.ready.clear()
+                await self.ready.wait()
+            text, _ = self.frames.popleft()
+            self.queued_bytes -= len(text)
+            WS_QUEUED_BYTES.dec(amount=len(text))
+            try:
+                await asyncio.wait_for(self.websocket.send_text(text), timeout=self.manager.send_timeout)
+            except asyncio.TimeoutError:
+                self.manager.evict(self, "send_timeout", CLOSE_TRY_AGAIN_LATER)
+                return
+            except Exception as e:
+                logger.info("Stopped writing to %s (%s): %s", self.user_id, self.connection_id, e)
+                self.closing = True
+                self._discard()
+                return
+
+    async def close(self, code: int):
+        self.writer.cancel()
+        await asyncio.gather(self.writer, return_exceptions=True)
+        self._discard()
+        try:
+            await asyncio.wait_for(self.websocket.close(code=code), timeout=self.manager.send_timeout)
+        except Exception:
+            pass
+
+
+class ConnectionManager:
+    """Tracks this worker's sockets and fans frames out to other workers over Redis pub/sub."""
+
+    def __init__(self, presence_ttl: int = 30, heartbeat_interval: int = 10, max_connections: int = 1000,
+                 outbox_frames: int = 256, outbox_bytes: int = 1048576, slow_client_policy: str = "drop",
+                 send_timeout: float = 10.0, ping_interval: float = 20.0, idle_timeout: float = 60.0):
+        self.worker_id = str(uuid.uuid4())
+        self.presence_ttl = presence_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.max_connections = max_connections
+        self.outbox_frames = outbox_frames
+        self.outbox_bytes = outbox_bytes
+        self.slow_client_policy = slow_client_policy
+        self.send_timeout = send_timeout
+        self.ping_interval = ping_interval
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[str, Dict[str, Outbox]] = {}
+        self.total = 0
+        self.redis_provider = None
+        self.pubsub = None
+        self._tasks = []
+        self._closing = set()
+
+    @classmethod
+    def from_env(cls) -> "ConnectionManager":
+        return cls(
+            presence_ttl=int(os.getenv("WS_PRESENCE_TTL", "30")),
+            heartbeat_interval=int(os.getenv("WS_HEARTBEAT_INTERVAL", "10")),
+            max_connections=int(os.getenv("WS_MAX_CONNECTIONS", "1000")),
+            outbox_frames=int(os.getenv("WS_OUTBOX_FRAMES", "256")),
+            outbox_bytes=int(os.getenv("WS_OUTBOX_BYTES", "1048576")),
+            slow_client_policy=os.getenv("WS_SLOW_CLIENT_POLICY", "drop"),
+            send_timeout=float(os.getenv("WS_SEND_TIMEOUT", "10")),
+            ping_interval=float(os.getenv("WS_PING_INTERVAL", "20")),
+            idle_timeout=float(os.getenv("WS_IDLE_TIMEOUT", "60")),
+        )
+
+    @property
+    def distributed(self) -> bool:
+        return self.pubsub is not None and self.redis_provider.mode == "connected"
+
+    async def start(self, redis_provider):
+        self.redis_provider = redis_provider
+        await self._sync_subscriptions()
+        if self.pubsub is None:
+            logger.warning("Redis unavailable; WebSocket delivery is limited to this worker until it returns")
+        self._tasks.append(asyncio.create_task(self._heartbeat()))
+        self._tasks.append(asyncio.create_task(self._ping()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        outboxes = [outbox for user_connections in self.connections.values() for outbox in user_connections.values()]
+        await asyncio.gather(*(outbox.close(CLOSE_GOING_AWAY) for outbox in outboxes), *self._closing,
+                             return_exceptions=True)
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+            self.pubsub = None
+
+    async def connect(self, websocket: WebSocket, user_id: str) -> Optional[str]:
+        """Accept the socket, or close it with 1013 and return None when the worker is full."""
+        await websocket.accept()
+        if self.total >= self.max_connections:
+            WS_REJECTED.inc()
+            logger.warning("Rejecting WebSocket for %s: %d connections open", user_id, self.total)
+            await websocket.close(code=CLOSE_TRY_AGAIN_LATER)
+            return None
+        connection_id = str(uuid.uuid4())
+        user_connections = self.connections.setdefault(user_id, {})
+        first = not user_connections
+        user_connections[connection_id] = Outbox(self, user_id, connection_id, websocket)
+        self.total += 1
+        WS_CONNECTIONS.inc()
+        if first and self.distributed:
+            await self.pubsub.subscribe(user_channel(user_id))
+        await self._touch(user_id, connection_id)
+        return connection_id
+
+    async def disconnect(self, user_id: str, connection_id: str):
+        user_connections = self.connections.get(user_id, {})
+        outbox = user_connections.pop(connection_id, None)
+        if outbox is not None:
+            self.total -= 1
+            WS_CONNECTIONS.dec()
+            outbox.closing = True
+            outbox.writer.cancel()
+            outbox._discard()
+        if not user_connections:
+            self.connections.pop(user_id, None)
+            if self.distributed:
+                try:
+                    await self.pubsub.unsubscribe(user_channel(user_id))
+                except Exception as e:
+                    logger.warning("Failed to unsubscribe %s: %s", user_id, e)
+        try:
+            await self.redis_provider.client.zrem(presence_key(user_id), connection_id)
+        except Exception as e:
+            logger.warning("Failed to clear presence for %s: %s", user_id, e)
+
+    def evict(self, outbox: Outbox, reason: str, code: int = CLOSE_POLICY_VIOLATION):
+        # Closing the socket ends the endpoint's receive loop, which then calls disconnect().
+        if outbox.closing:
+            return
+        outbox.closing = True
+        WS_EVICTIONS.inc(reason)
+        logger.info("Evicting %s (%s): %s", outbox.user_id, outbox.connection_id, reason)
+        task = asyncio.create_task(outbox.close(code))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    def seen(self, user_id: str, connection_id: str):
+        outbox = self.connections.get(user_id, {}).get(connection_id)
+        if outbox is not None:
+            outbox.last_seen = time.monotonic()
+
+    def _deliver(self, user_id: str, message: dict, connection_id: Optional[str]):
+        user_connections = self.connections.get(user_id, {})
+        if connection_id is not None:
+            targets = [user_connections[connection_id]] if connection_id in user_connections else []
+        else:
+            targets = list(user_connections.values())
+        if not targets:
+            return
+        text = codec.encode_frame(message)
+        droppable = message.get("type") in DROPPABLE_TYPES
+        for outbox in targets:
+            outbox.put(text, droppable)
+
+    async def send(self, user_id: str, message: dict, connection_id: Optional[str] = None):
+        # Replies go to the connection whose message is being handled; frames sent
+        # outside a handler reach every connection the user has on any worker.
+        if connection_id is None:
+            connection_id = current_connection.get()
+        trace_id = current_trace.get()
+        if trace_id is not None:
+            message = {**message, "trace_id": trace_id}
+        self._deliver(user_id, message, connection_id)
+        if connection_id is not None and connection_id in self.connections.get(user_id, {}):
+            return
+        if self.distributed:
+            try:
+                envelope = {"origin": self.worker_id, "connection_id": connection_id, "message": message}
+                await self.redis_provider.redis.publish(user_channel(user_id), codec.encode_frame(envelope))
+            except Exception as e:
+                logger.warning("Failed to publish frame for %s: %s", user_id, e)
+
+    async def _touch(self, user_id: str, connection_id: str):
+        try:
+            rdb = self.redis_provider.client
+            await rdb.zadd(presence_key(user_id), {connection_id: time.time()})
+            await rdb.expire(presence_key(user_id), self.presence_ttl)
+        except Exception as e:
+            logger.warning("Failed to record presence for %s: %s", user_id, e)
+
+    async def _sync_subscriptions(self):
+        """Open pub/sub once Redis is reachable and subscribe the channels of users who connected without it."""
+        if self.redis_provider.mode != "connected":
+            return
+        if self.pubsub is None:
+            pubsub = self.redis_provider.redis.pubsub()
+            # Keeps the pub/sub connection subscribed even when no users are connected.
+            await pubsub.subscribe(f"ws:worker:{self.worker_id}")
+            self.pubsub = pubsub
+            self._tasks.append(asyncio.create_task(self._listen()))
+            logger.info("Redis pub/sub connected; WebSocket frames fan out across workers")
+        missing = [user_channel(user_id) for user_id, user_connections in list(self.connections.items())
+                   if user_connections and user_channel(user_id) not in self.pubsub.channels]
+        if missing:
+            await self.pubsub.subscribe(*missing)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self._sync_subscriptions()
+            except Exception as e:
+                logger.warning("Pub/sub subscription failed: %s", e)
+            now = time.time()
+            try:
+                async with self.redis_provider.client.pipeline(transaction=False) as pipe:
+                    for user_id, user_connections in list(self.connections.items()):
+                        if not user_connections:
+                            continue
+                        pipe.zadd(presence_key(user_id), {cid: now for cid in user_connections})
+                        pipe.zremrangebyscore(presence_key(user_id), "-inf", now - self.presence_ttl)
+                        pipe.expire(presence_key(user_id), self.presence_ttl)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning("Presence heartbeat failed: %s", e)
+
+    async def _ping(self):
+        # Clients answer {"type": "ping"} with {"type": "pong"}; any inbound frame counts as activity.
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            ping = codec.encode_frame({"type": "ping", "ts": int(time.time())})
+            for user_connections in list(self.connections.values()):
+                for outbox in list(user_connections.values()):
+                    if now - outbox.last_seen > self.idle_timeout:
+                        self.evict(outbox, "idle", CLOSE_POLICY_VIOLATION)
+                    else:
+                        outbox.put(ping, droppable=True)
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None or message["type"] != "message":
+                    continue
+                envelope = codec.decode_frame(message["data"])
+                if envelope.get("origin") == self.worker_id:
+                    continue
+                user_id = message["channel"].split(":", 2)[2]
+                self._deliver(user_id, envelope["message"], envelope.get("connection_id"))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Pub/sub listener error: %s", e)
+                await asyncio.sleep(1)
@@ -0,0 +1,192 @@
+import os
+import time
+import uuid
+import asyncio
+import argparse
+from typing import List, Optional
+
+import codec
+
+MAX_CONVERSATIONS = 20
+MAX_PAGE_SIZE = 50
+MAX_HISTORY_MESSAGES = 100
+CONVERSATION_TTL = 2592000
+
+
+def index_key(user_id: str) -> str:
+    return f"conversations:{user_id}"
+
+
+def conversation_key(user_id: str, conversation_id: str) -> str:
+    return f"conversation:{user_id}:{conversation_id}"
+
+
+def legacy_key(user_id: str) -> str:
+    return f"user_conversations:{user_id}"
+
+
+def history_key(user_id: str, topic: str) -> str:
+    return f"chat_log:{user_id}:{topic}"
+
+
+def legacy_history_key(user_id: str, topic: str) -> str:
+    return f"chat_history:{user_id}:{topic}"
+
+
+def _merge_history(legacy: Optional[str], messages: List[str]) -> List[dict]:
+    # A legacy JSON blob always predates the list, so its messages come first.
+    history = (codec.loads(legacy) if legacy else []) + [codec.loads(message) for message in messages]
+    return history[-MAX_HISTORY_MESSAGES:]
+
+
+def _queue_conversation(pipe, user_id: str, conversation: dict, score: float):
+    pipe.hset(conversation_key(user_id, conversation["id"]), mapping=conversation)
+    pipe.expire(conversation_key(user_id, conversation["id"]), CONVERSATION_TTL)
+    pipe.zadd(index_key(user_id), {conversation["id"]: score})
+
+
+def _queue_trim(pipe, user_id: str):
+    # Trimmed conversation hashes are left to expire with their TTL.
+    pipe.zremrangebyrank(index_key(user_id), 0, -MAX_CONVERSATIONS - 1)
+    pipe.expire(index_key(user_id), CONVERSATION_TTL)
+
+
+async def migrate_legacy(rdb, user_id: str) -> int:
+    """Move a user_conversations:{user_id} JSON blob into the index/hash layout."""
+    data = await rdb.get(legacy_key(user_id))
+    if not data:
+        return 0
+    conversations = codec.loads(data)
+    async with rdb.pipeline(transaction=True) as pipe:
+        for position, conv in enumerate(conversations):
+            conv = {k: str(v) for k, v in conv.items() if v is not None}
+            # The blob is newest first; keep that order for conversations created in the same second.
+            _queue_conversation(pipe, user_id, conv, int(conv.get("timestamp", 0)) * 1000 - position)
+        _queue_trim(pipe, user_id)
+        pipe.delete(legacy_key(user_id))
+        await pipe.execute()
+    return len(conversations)
+
+
+async def record_conversation(rdb, user_id: str, topic: str) -> dict:
+    now = time.time()
+    conversation = {
+        "id": str(uuid.uuid4()),
+        "title": topic[:50] + "..." if len(topic) > 50 else topic,
+        "topic": topic,
+        "timestamp": str(int(now)),
+        "user_id": user_id,
+    }
+    async with rdb.pipeline(transaction=True) as pipe:
+        _queue_conversation(pipe, user_id, conversation, now * 1000)
+        _queue_trim(pipe, user_id)
+        pipe.exists(legacy_key(user_id))
+        results = await pipe.execute()
+    if results[-1]:
+        await migrate_legacy(rdb, user_id)
+    return conversation
+
+
+async def list_conversations(rdb, user_id: str, limit: int = 20, cursor: Optional[str] = None,
+                             include_history: bool = True) -> dict:
+    """Newest-first page of conversations; cursor is the id of the last conversation already seen."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    start = 0
+    if cursor:
+        rank = await rdb.zrevrank(index_key(user_id), cursor)
+        if rank is None:
+            return {"conversations": [], "next_cursor": None}
+        start = rank + 1
+    ids = await rdb.zrevrange(index_key(user_id), start, start + limit)
+    if not ids and not cursor and await migrate_legacy(rdb, user_id):
+        ids = await rdb.zrevrange(index_key(user_id), 0, limit)
+
+    has_more = len(ids) > limit
+    ids = ids[:limit]
+    async with rdb.pipeline(transaction=False) as pipe:
+        for conversation_id in ids:
+            pipe.hgetall(conversation_key(user_id, conversation_id))
+        page = [conv for conv in await pipe.execute() if conv]
+    next_cursor = ids[-1] if has_more else None
+
+    if include_history and page:
+        async with rdb.pipeline(transaction=False) as pipe:
+            for conv in page:
+                pipe.get(legacy_history_key(user_id, conv["topic"]))
+                pipe.lrange(history_key(user_id, conv["topic"]), 0, -1)
+            results = await pipe.execute()
+        for conv, legacy, messages in zip(page, results[::2], results[1::2]):
+            conv["chat_history"] = _merge_history(legacy, messages)
+    return {"conversations": page, "next_cursor": next_cursor}
+
+
+async def append_history(rdb, user_id: str, topic: str, messages: List[dict]):
+    """Add {type, content, timestamp} messages to the history the conversation view renders."""
+    key = history_key(user_id, topic)
+    async with rdb.pipeline(transaction=True) as pipe:
+        pipe.rpush(key, *[codec.dumps(message) for message in messages])
+        pipe.ltrim(key, -MAX_HISTORY_MESSAGES, -1)
+        pipe.expire(key, CONVERSATION_TTL)
+        pipe.exists(legacy_history_key(user_id, topic))
+        results = await pipe.execute()
+    if results[-1]:
+        await migrate_history(rdb, user_id, topic)
+
+
+async def migrate_history(rdb, user_id: str, topic: str):
+    """Fold a chat_history:{user_id}:{topic} JSON blob into the front of the message list."""
+    legacy = legacy_history_key(user_id, topic)
+    # GET and DEL in one transaction, so concurrent appends cannot both claim the blob.
+    async with rdb.pipeline(transaction=True) as pipe:
+        pipe.get(legacy)
+        pipe.delete(legacy)
+        data, _ = await pipe.execute()
+    if not data:
+        return
+    key = history_key(user_id, topic)
+    async with rdb.pipeline(transaction=True) as pipe:
+        # LPUSH inserts its arguments one at a time, so they go in reversed to keep the blob's order.
+        pipe.lpush(key, *[codec.dumps(message) for message in reversed(codec.loads(data))])
+        pipe.ltrim(key, -MAX_HISTORY_MESSAGES, -1)
+        pipe.expire(key, CONVERSATION_TTL)
+        await pipe.execute()
+
+
+async def get_conversation_history(rdb, user_id: str, conversation_id: str) -> Optional[List[dict]]:
+    topic = await rdb.hget(conversation_key(user_id, conversation_id), "topic")
+    if topic is None:
+        return None
+    async with rdb.pipeline(transaction=False) as pipe:
+        pipe.get(legacy_history_key(user_id, topic))
+        pipe.lrange(history_key(user_id, topic), 0, -1)
+        legacy, messages = await pipe.execute()
+    return _merge_history(legacy, messages)
+
+
+async def migrate_all(rdb) -> dict:
+    users = 0
+    conversations = 0
+    async for key in rdb.scan_iter(match="user_conversations:*", count=1000):
+        conversations += await migrate_legacy(rdb, key.split(":", 1)[1])
+        users += 1
+    return {"users": users, "conversations": conversations}
+
+
+async def _main(args):
+    import redis.asyncio as redis
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    rdb = redis.from_url(args.redis_url or os.getenv("REDIS_URL", "redis://localhost:6379"), decode_responses=True)
+    try:
+        report = await migrate_all(rdb)
+        print(f"Migrated {report['conversations']} conversations for {report['users']} users")
+    finally:
+        await rdb.aclose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate user_conversations JSON blobs to the Redis-native layout")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--redis-url", default=None)
+    asyncio.run(_main(parser.parse_args()))
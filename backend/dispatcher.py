@@ -0,0 +1,110 @@
+import os
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from log import get_logger
+
+logger = get_logger(__name__)
+
+current_dispatcher: contextvars.ContextVar = contextvars.ContextVar("current_dispatcher", default=None)
+
+_user_slots: Dict[str, list] = {}
+
+
+def _acquire_user_slots(user_id: str, concurrency: int) -> asyncio.Semaphore:
+    entry = _user_slots.get(user_id)
+    if entry is None:
+        entry = _user_slots[user_id] = [asyncio.Semaphore(concurrency), 0]
+    entry[1] += 1
+    return entry[0]
+
+
+def _release_user_slots(user_id: str):
+    entry = _user_slots.get(user_id)
+    if entry is not None:
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _user_slots[user_id]
+
+
+class MessageDispatcher:
+    """Runs a connection's messages as tasks so the socket keeps being read during generation."""
+
+    def __init__(self, user_id: str, handler: Callable[[dict], Awaitable[None]],
+                 max_queue: int = 32, concurrency: int = 2):
+        self.user_id = user_id
+        self.handler = handler
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.slots = _acquire_user_slots(user_id, concurrency)
+        self.tasks: Set[asyncio.Task] = set()
+        self.generation: Optional[asyncio.Task] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.closed = False
+
+    @classmethod
+    def from_env(cls, user_id: str, handler: Callable[[dict], Awaitable[None]]) -> "MessageDispatcher":
+        return cls(
+            user_id,
+            handler,
+            max_queue=int(os.getenv("WS_INBOUND_QUEUE", "32")),
+            concurrency=int(os.getenv("WS_USER_CONCURRENCY", "2")),
+        )
+
+    def start(self):
+        self.worker = asyncio.create_task(self._work())
+
+    def submit(self, message: dict) -> bool:
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def track(self, task: asyncio.Task):
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def begin_generation(self):
+        """Mark the calling task as the connection's generation, cancelling the one it supersedes.
+
+        Called by the handler once it knows a message asks for a lesson or answer, so small talk or a
+        quiz request never cancels a lesson in flight.
+        """
+        task = asyncio.current_task()
+        if self.generation is not None and self.generation is not task and not self.generation.done():
+            logger.debug("Cancelling superseded generation for user %s", self.user_id)
+            self.generation.cancel()
+        self.generation = task
+
+    async def _work(self):
+        while True:
+            message = await self.queue.get()
+            await self.slots.acquire()
+            token = current_dispatcher.set(self)
+            try:
+                task = asyncio.create_task(self._run(message))
+            finally:
+                current_dispatcher.reset(token)
+            task.add_done_callback(lambda t: self.slots.release())
+            self.track(task)
+
+    async def _run(self, message: dict):
+        try:
+            await self.handler(message)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.exception("Error handling message for %s: %s", self.user_id, e)
+
+    async def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        pending = [task for task in (self.worker, *self.tasks) if task is not None]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        _release_user_slots(self.user_id)
@@ -0,0 +1,129 @@
+import json
+import time
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError, field_validator
+
+from llm_json import extract_json
+
+EXPLANATION_TTL = 30 * 86400
+
+
+def _normalize_answer(answer) -> str:
+    return " ".join(str(answer).split()).lower()
+
+
+def pass_status_for(score: int) -> str:
+    if score >= 80:
+        return "pass"
+    if score >= 50:
+        return "improve"
+    return "retake"
+
+
+OVERALL_FEEDBACK = {
+    "pass": "Excellent work! You have a strong grasp of {topic}.",
+    "improve": "Good effort! Review the questions you missed to strengthen your understanding of {topic}.",
+    "retake": "Don't give up! Revisit the lesson on {topic} and try the assessment again.",
+}
+
+
+def grade_assessment(assessment: dict, user_answers: Dict[str, str]) -> dict:
+    topic = assessment["topic"]
+    feedback = []
+    missed = []
+    for question in assessment["questions"]:
+        user_answer = user_answers.get(question["id"], "No answer provided")
+        is_correct = _normalize_answer(user_answer) == _normalize_answer(question["correct_answer"])
+        if not is_correct:
+            missed.append(question["question"])
+        feedback.append({
+            "id": question["id"],
+            "question": question["question"],
+            "user_answer": user_answer,
+            "correct_answer": question["correct_answer"],
+            "is_correct": is_correct,
+            "explanation": question.get("explanation", ""),
+            "score": 1 if is_correct else 0,
+        })
+
+    total_questions = len(assessment["questions"])
+    correct_count = sum(item["score"] for item in feedback)
+    final_score = round((correct_count / total_questions) * 100) if total_questions > 0 else 0
+    final_pass_status = pass_status_for(final_score)
+    overall_feedback = OVERALL_FEEDBACK[final_pass_status].format(topic=topic)
+
+    return {
+        "score": final_score,
+        "pass_status": final_pass_status,
+        "correct_answers": correct_count,
+        "total_questions": total_questions,
+        "feedback": feedback,
+        "overall_feedback": overall_feedback,
+        "suggestions": f"Review: {'; '.join(missed)}" if missed else "",
+        "strengths": f"{correct_count} of {total_questions} answered correctly" if correct_count else "",
+        "weakness_areas": "; ".join(missed),
+        "congratulatory_message": overall_feedback if final_pass_status == "pass" else "",
+        "retake_message": overall_feedback if final_pass_status == "retake" else "",
+        "improvement_message": overall_feedback if final_pass_status == "improve" else "",
+        "topic": topic,
+        "timestamp": int(time.time()),
+    }
+
+
+def explanation_key(question: dict) -> str:
+    digest = hashlib.sha1(
+        json.dumps([question["question"], question["correct_answer"]]).encode()
+    ).hexdigest()
+    return f"explanation:{digest}"
+
+
+async def cached_explanations(rdb, feedback: List[dict]) -> List[Optional[str]]:
+    keys = [explanation_key(item) for item in feedback]
+    return await rdb.mget(keys) if keys else []
+
+
+async def store_explanations(rdb, feedback: List[dict], explanations: Dict[str, str]):
+    for item in feedback:
+        explanation = explanations.get(item["id"])
+        if explanation:
+            await rdb.setex(explanation_key(item), EXPLANATION_TTL, explanation)
+
+
+class GeneratedExplanation(BaseModel):
+    id: str
+    explanation: str
+
+    @field_validator("id", mode="before")
+    @classmethod
+    def id_text(cls, value: Any) -> str:
+        return str(value) if isinstance(value, (int, str)) else value
+
+    @field_validator("id", "explanation")
+    @classmethod
+    def not_blank(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("blank")
+        return value
+
+
+class GeneratedExplanations(BaseModel):
+    explanations: List[Any] = []
+
+
+def parse_explanations(response: str) -> Tuple[Dict[str, str], Tuple[str, ...]]:
+    """Explanations by question id, plus the repairs needed to read the response; raises ValueError if unreadable."""
+    extracted = extract_json(response)
+    try:
+        data = GeneratedExplanations.model_validate(extracted.value)
+    except ValidationError as e:
+        raise ValueError(f"Explanations response has the wrong shape: {e}") from None
+    explanations = {}
+    for item in data.explanations:
+        try:
+            explanation = GeneratedExplanation.model_validate(item)
+        except ValidationError:
+            continue
+        explanations[explanation.id] = explanation.explanation
+    return explanations, extracted.repairs
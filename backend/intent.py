@@ -0,0 +1,139 @@
+import re
+import itertools
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+GREETING = "greeting"
+THANKS = "thanks"
+FAREWELL = "farewell"
+ACKNOWLEDGEMENT = "acknowledgement"
+LESSON = "lesson"
+QUESTION = "question"
+QUIZ_REQUEST = "quiz_request"
+
+CASUAL_INTENTS = {GREETING, THANKS, FAREWELL, ACKNOWLEDGEMENT}
+
+
+def _patterns(*phrases: str) -> List[re.Pattern]:
+    return [re.compile(rf"\b{phrase}\b", re.IGNORECASE) for phrase in phrases]
+
+
+# (intent, weight, patterns); a casual intent only wins when little else is left in the message.
+RULES: List[Tuple[str, float, List[re.Pattern]]] = [
+    (GREETING, 2.0, _patterns(r"h(i|ello|ey|owdy)+", r"good (morning|afternoon|evening)", r"greetings", r"yo", r"sup")),
+    (THANKS, 2.0, _patterns(r"thanks?( you)?", r"thx", r"ty", r"cheers", r"appreciate (it|that)", r"much appreciated")),
+    (FAREWELL, 2.0, _patterns(r"(good)?bye", r"see (you|ya)( later)?", r"good ?night", r"later", r"take care", r"cya")),
+    (ACKNOWLEDGEMENT, 1.5, _patterns(r"ok(ay)?", r"k", r"got it", r"sure", r"cool", r"great", r"nice", r"alright",
+                                     r"makes sense", r"understood", r"yes", r"yep", r"no", r"nope")),
+    (QUIZ_REQUEST, 3.0, _patterns(r"quiz( me)?", r"test me", r"(quick|short|practice) test", r"(practice|test) questions?",
+                                  r"assessment", r"examine me", r"check my (knowledge|understanding)")),
+    (LESSON, 2.0, _patterns(r"explain", r"teach( me)?", r"tell me about", r"learn( about)?", r"lesson( on| about)?",
+                            r"introduc(e|tion) to", r"overview of", r"walk me through", r"basics of")),
+    (QUESTION, 1.5, _patterns(r"what", r"why", r"how", r"when", r"where", r"who", r"which", r"can you", r"could you",
+                              r"is it", r"are there", r"does", r"do (i|you|we)", r"difference between")),
+]
+
+_FILLER = re.compile(r"\b(so|very|much|a lot|lots|there|you|all|again|for (that|this|the help|everything)|now|then|"
+                     r"man|mate|friend|buddy|tutor|bot|for now|and|oh|ah|well)\b", re.IGNORECASE)
+# Words that point back at the conversation: "tell me more about it", "explain that again", "give me an example".
+_REFERS_BACK = re.compile(r"\b(it|its|that|this|these|those|they|them|again|more|simpler|elaborate|examples?|"
+                          r"previous|above)\b", re.IGNORECASE)
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+# Asking to be quizzed, as opposed to asking about quizzes: "quiz me", "give me a quiz", "I'd like a test".
+_QUIZ_COMMAND = re.compile(
+    r"\b(quiz|test|examine) me\b|\bcheck my (knowledge|understanding)\b|"
+    r"\b(give me|i('d| would)? (like|want|need)|let'?s (do|have|try)|can i (have|take|get)|start)\s+"
+    r"(a|an|some|another)\s+((quick|short|practice)\s+)?(quiz|test|assessment|practice questions?)\b|"
+    r"^((a|another)\s+)?((quick|short|practice)\s+)?(quiz|test)(\s+please)?$",
+    re.IGNORECASE,
+)
+_QUIZ_TOPIC = re.compile(
+    r"\b(quiz|test|assessment|questions?|understanding|knowledge)(\s+me)?\s+(on|about|for|over|of)\s+"
+    r"(?P<topic>.+?)(\s+please)?[?.!\s]*$",
+    re.IGNORECASE,
+)
+
+REPLIES: Dict[str, List[str]] = {
+    GREETING: [
+        "Hello! What would you like to learn today?",
+        "Hi there! Give me a topic and I'll walk you through it.",
+        "Hey! Ready to learn something new? Just name a topic.",
+    ],
+    THANKS: [
+        "You're welcome! Let me know if you'd like to explore another topic.",
+        "Happy to help! Want to test yourself with a quick quiz?",
+        "Anytime! What should we learn next?",
+    ],
+    FAREWELL: [
+        "Goodbye! Come back anytime you want to learn something new.",
+        "See you later! Keep up the great learning.",
+        "Bye for now! Your progress will be here when you return.",
+    ],
+    ACKNOWLEDGEMENT: [
+        "Great! Ask me about any topic whenever you're ready.",
+        "Sounds good! What would you like to learn next?",
+        "Got it! Let me know if anything needs more explanation.",
+    ],
+}
+_reply_cycles = {intent: itertools.cycle(replies) for intent, replies in REPLIES.items()}
+
+
+class Intent(NamedTuple):
+    name: str
+    score: float
+    casual: bool
+
+
+def classify(text: str) -> Intent:
+    cleaned = _PUNCTUATION.sub(" ", text).strip()
+    words = cleaned.split()
+    if not words:
+        return Intent(ACKNOWLEDGEMENT, 0.0, True)
+
+    scores: Dict[str, float] = {}
+    residue = cleaned
+    for intent, weight, patterns in RULES:
+        for pattern in patterns:
+            matches = pattern.findall(cleaned)
+            if matches:
+                scores[intent] = scores.get(intent, 0.0) + weight * len(matches)
+                if intent in CASUAL_INTENTS:
+                    residue = pattern.sub(" ", residue)
+    leftover = len(_FILLER.sub(" ", residue).split())
+
+    # Casual phrases only count when they are the whole message: "great depression" or "hello world" is a topic.
+    casual_scores = {intent: score for intent, score in scores.items() if intent in CASUAL_INTENTS}
+    if casual_scores and leftover == 0 and len(words) <= 6:
+        name = max(casual_scores, key=casual_scores.get)
+        return Intent(name, casual_scores[name], True)
+
+    task_scores = {intent: score for intent, score in scores.items() if intent not in CASUAL_INTENTS}
+    if text.rstrip().endswith("?"):
+        task_scores[QUESTION] = task_scores.get(QUESTION, 0.0) + 1.0
+    if QUIZ_REQUEST in task_scores and not _asks_for_quiz(cleaned, text, task_scores):
+        # "what is a quiz?" or "explain risk assessment" mention quizzes but want an answer.
+        del task_scores[QUIZ_REQUEST]
+    if not task_scores:
+        return Intent(LESSON, 0.0, False)
+    name = max(task_scores, key=task_scores.get)
+    return Intent(name, task_scores[name], False)
+
+
+def _asks_for_quiz(cleaned: str, text: str, task_scores: Dict[str, float]) -> bool:
+    if _QUIZ_COMMAND.search(cleaned):
+        return True
+    # "practice questions on algebra" names a topic; "what is a test for covid" is still a question.
+    return quiz_topic(text) is not None and LESSON not in task_scores and QUESTION not in task_scores
+
+
+def casual_reply(intent: str) -> str:
+    return next(_reply_cycles[intent])
+
+
+def refers_back(text: str) -> bool:
+    """True when a request only makes sense against earlier turns, so its answer must not be shared via the cache."""
+    return bool(_REFERS_BACK.search(text))
+
+
+def quiz_topic(text: str) -> Optional[str]:
+    match = _QUIZ_TOPIC.search(text.strip())
+    return match.group("topic").strip() if match else None
@@ -0,0 +1,132 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from log import get_logger
+from topics import request_key
+
+logger = get_logger(__name__)
+
+
+class LessonCache:
+    """Two-tier response cache: bounded in-process LRU (L1) in front of Redis with a TTL (L2)."""
+
+    def __init__(self, model: str, prompt_version: str, max_entries: int = 512, ttl: int = 86400,
+                 cacheable: Callable[[str], bool] = bool):
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cacheable = cacheable
+        self._l1: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {"l1_hits": 0, "l2_hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    @classmethod
+    def from_env(cls, model: str, prompt_version: str, cacheable: Callable[[str], bool] = bool) -> "LessonCache":
+        return cls(
+            model=model,
+            prompt_version=prompt_version,
+            max_entries=int(os.getenv("LESSON_CACHE_SIZE", "512")),
+            ttl=int(os.getenv("LESSON_CACHE_TTL", "86400")),
+            cacheable=cacheable,
+        )
+
+    @property
+    def prefix(self) -> str:
+        return f"lesson_cache:{self.model}:{self.prompt_version}:"
+
+    def key(self, raw_topic: str) -> str:
+        return self.prefix + request_key(raw_topic)
+
+    def _l1_get(self, key: str) -> Optional[str]:
+        entry = self._l1.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._l1[key]
+            return None
+        self._l1.move_to_end(key)
+        return value
+
+    def _l1_set(self, key: str, value: str):
+        self._l1[key] = (value, time.monotonic() + self.ttl)
+        self._l1.move_to_end(key)
+        while len(self._l1) > self.max_entries:
+            self._l1.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def get(self, rdb, raw_topic: str) -> Optional[str]:
+        key = self.key(raw_topic)
+        value = self._l1_get(key)
+        if value is not None:
+            self.stats["l1_hits"] += 1
+            return value
+        try:
+            value = await rdb.get(key)
+        except Exception as e:
+            logger.warning("Lesson cache L2 read failed: %s", e)
+            value = None
+        if value is not None:
+            self.stats["l2_hits"] += 1
+            self._l1_set(key, value)
+        return value
+
+    async def set(self, rdb, raw_topic: str, value: str):
+        key = self.key(raw_topic)
+        self._l1_set(key, value)
+        try:
+            await rdb.setex(key, self.ttl, value)
+        except Exception as e:
+            logger.warning("Lesson cache L2 write failed: %s", e)
+
+    async def get_or_generate(self, rdb, raw_topic: str, generate: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """Return (content, cached); cached is False only for the caller whose generate() ran."""
+        value = await self.get(rdb, raw_topic)
+        if value is not None:
+            return value, True
+
+        key = self.key(raw_topic)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending), True
+            except Exception:
+                pass
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            value = await generate()
+            if self.cacheable(value):
+                await self.set(rdb, raw_topic, value)
+            future.set_result(value)
+            return value, False
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else RuntimeError("Lesson generation cancelled"))
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def invalidate(self, rdb, raw_topic: Optional[str] = None) -> int:
+        if raw_topic is not None:
+            key = self.key(raw_topic)
+            self._l1.pop(key, None)
+            removed = await rdb.delete(key)
+        else:
+            self._l1.clear()
+            removed = 0
+            async for key in rdb.scan_iter(match=f"{self.prefix}*", count=500):
+                removed += await rdb.delete(key)
+        self.stats["invalidations"] += 1
+        return removed
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "l1_size": len(self._l1), "l1_capacity": self.max_entries, "in_flight": len(self._inflight)}
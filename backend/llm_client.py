@@ -0,0 +1,187 @@
+import os
+import json
+import random
+import asyncio
+import httpx
+from typing import AsyncIterator, Optional
+
+from metrics import LLM_ERRORS
+
+
+class LLMError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMSettings:
+    def __init__(self, api_key: Optional[str] = None, base_url: str = "https://api.openai.com/v1",
+                 model: str = "gpt-3.5-turbo", connect_timeout: float = 5.0, read_timeout: float = 30.0,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 8.0,
+                 max_in_flight: int = 32, max_connections: int = 64, max_keepalive: int = 32):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+
+    @classmethod
+    def from_env(cls) -> "LLMSettings":
+        return cls(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "30")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+            backoff_base=float(os.getenv("LLM_BACKOFF_BASE", "0.5")),
+            backoff_max=float(os.getenv("LLM_BACKOFF_MAX", "8")),
+            max_in_flight=int(os.getenv("LLM_MAX_IN_FLIGHT", "32")),
+            max_connections=int(os.getenv("LLM_MAX_CONNECTIONS", "64")),
+            max_keepalive=int(os.getenv("LLM_MAX_KEEPALIVE", "32")),
+        )
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def _malformed(what: str, error: Exception) -> LLMError:
+    LLM_ERRORS.inc("malformed")
+    return LLMError(f"Malformed {what}: {type(error).__name__}: {error}")
+
+
+def _completion_content(body: bytes) -> str:
+    try:
+        content = json.loads(body)["choices"][0]["message"]["content"]
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        raise _malformed("completion response", e) from None
+    if not isinstance(content, str):
+        raise _malformed("completion response", TypeError(f"content is {type(content).__name__}"))
+    return content
+
+
+def _stream_delta(data: str) -> Optional[str]:
+    try:
+        choices = json.loads(data).get("choices") or [{}]
+        delta = (choices[0].get("delta") or {}).get("content")
+    except (ValueError, IndexError, TypeError, AttributeError) as e:
+        raise _malformed("stream event", e) from None
+    return delta if isinstance(delta, str) else None
+
+
+class LLMClient:
+    """Shared keep-alive client for the chat-completions API."""
+
+    def __init__(self, settings: Optional[LLMSettings] = None):
+        self.settings = settings or LLMSettings.from_env()
+        self.http: Optional[httpx.AsyncClient] = None
+        self._in_flight = asyncio.Semaphore(self.settings.max_in_flight)
+
+    async def startup(self):
+        if self.http is not None:
+            return
+        settings = self.settings
+        self.http = httpx.AsyncClient(
+            base_url=settings.base_url,
+            headers={
+                "Authorization": f"Bearer {settings.api_key}",
+                "Content-Type": "application/json",
+            },
+            timeout=httpx.Timeout(settings.read_timeout, connect=settings.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.max_connections,
+                max_keepalive_connections=settings.max_keepalive,
+            ),
+        )
+
+    async def shutdown(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+    def _payload(self, prompt: str, temperature: float, max_tokens: int, stream: bool = False) -> dict:
+        payload = {
+            "model": self.settings.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.settings.backoff_max)
+            except ValueError:
+                pass
+        ceiling = min(self.settings.backoff_max, self.settings.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    async def complete(self, prompt: str, temperature: float = 0.7, max_tokens: int = 2000) -> str:
+        await self.startup()
+        payload = self._payload(prompt, temperature, max_tokens)
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                async with self._in_flight:
+                    response = await self.http.post("/chat/completions", json=payload)
+                if response.status_code == 200:
+                    return _completion_content(response.content)
+                error = LLMError(f"{response.status_code} - {response.text}", response.status_code)
+                LLM_ERRORS.inc(str(response.status_code))
+                retryable = response.status_code in RETRYABLE_STATUS
+                retry_after = response.headers.get("retry-after")
+            except httpx.TransportError as e:
+                error = LLMError(f"{type(e).__name__}: {e}")
+                LLM_ERRORS.inc("transport")
+                retryable = True
+            if not retryable or attempt >= self.settings.max_retries:
+                raise error
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    async def stream(self, prompt: str, temperature: float = 0.7, max_tokens: int = 2000) -> AsyncIterator[str]:
+        """Yield content deltas from the SSE stream; retries only happen before the first delta."""
+        await self.startup()
+        payload = self._payload(prompt, temperature, max_tokens, stream=True)
+        attempt = 0
+        started = False
+        while True:
+            retry_after = None
+            try:
+                async with self._in_flight:
+                    async with self.http.stream("POST", "/chat/completions", json=payload) as response:
+                        if response.status_code == 200:
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[5:].strip()
+                                if data == "[DONE]":
+                                    return
+                                delta = _stream_delta(data)
+                                if delta:
+                                    started = True
+                                    yield delta
+                            return
+                        await response.aread()
+                        error = LLMError(f"{response.status_code} - {response.text}", response.status_code)
+                        LLM_ERRORS.inc(str(response.status_code))
+                        retryable = response.status_code in RETRYABLE_STATUS
+                        retry_after = response.headers.get("retry-after")
+            except httpx.TransportError as e:
+                error = LLMError(f"{type(e).__name__}: {e}")
+                LLM_ERRORS.inc("transport")
+                retryable = not started
+            if not retryable or attempt >= self.settings.max_retries:
+                raise error
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
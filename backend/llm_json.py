@@ -0,0 +1,183 @@
+import json
+from typing import Any, List, NamedTuple, Optional, Tuple
+
+_CLOSERS = {"{": "}", "[": "]"}
+# Balanced candidates tried before giving up, so a stray "{" in leading prose does not sink the response.
+MAX_CANDIDATES = 5
+
+
+class JsonExtractionError(ValueError):
+    pass
+
+
+class Extraction(NamedTuple):
+    value: Any
+    repairs: Tuple[str, ...] = ()
+
+
+def _repair(body: str) -> Tuple[str, Tuple[str, ...]]:
+    """Drop trailing commas and add commas missing between adjacent objects, outside of strings."""
+    out = []
+    repairs = set()
+    in_string = escaped = False
+    length = len(body)
+    index = 0
+    while index < length:
+        char = body[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            out.append(char)
+            index += 1
+            continue
+        if char in ",}]":
+            ahead = index + 1
+            while ahead < length and body[ahead].isspace():
+                ahead += 1
+            if char == "," and ahead < length and body[ahead] in "}]":
+                repairs.add("trailing_comma")
+                index += 1
+                continue
+            if char in "}]" and ahead < length and body[ahead] in "{[":
+                out.append(char + ",")
+                repairs.add("missing_comma")
+                index += 1
+                continue
+        elif char == '"':
+            in_string = True
+        out.append(char)
+        index += 1
+    return "".join(out), tuple(sorted(repairs))
+
+
+def _load(body: str, repairs: Tuple[str, ...] = ()) -> Extraction:
+    try:
+        # strict=False accepts raw newlines and tabs inside strings, which models emit often.
+        return Extraction(json.loads(body, strict=False), repairs)
+    except json.JSONDecodeError as e:
+        fixed, extra = _repair(body)
+        if not extra:
+            raise JsonExtractionError(f"Invalid JSON: {e}") from None
+        try:
+            return Extraction(json.loads(fixed, strict=False), repairs + extra)
+        except json.JSONDecodeError as e:
+            raise JsonExtractionError(f"Invalid JSON after repair: {e}") from None
+
+
+def _scan(text: str, start: int) -> Tuple[Optional[int], Optional[Tuple[int, Tuple[str, ...]]]]:
+    """Return the end of the balanced object opening at `start`, or the last cut point if it never closes."""
+    stack: List[str] = []
+    in_string = escaped = False
+    cut = None
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append(char)
+        elif char in "}]":
+            if not stack or _CLOSERS[stack.pop()] != char:
+                raise JsonExtractionError(f"Unbalanced '{char}' at offset {index}")
+            if not stack:
+                return index + 1, None
+            cut = (index + 1, tuple(stack))
+        elif char == ",":
+            # Everything before a separator is complete; a truncated tail is cut back to here.
+            cut = (index, tuple(stack))
+    return None, cut
+
+
+def extract_json(text: str) -> Extraction:
+    """Find the first JSON object in a model response, ignoring fences and prose, and repair common defects."""
+    start = text.find("{")
+    end = text.rfind("}")
+    if 0 <= start < end:
+        # Fast path for well-formed output: fences and prose only ever surround the object.
+        try:
+            return Extraction(json.loads(text[start:end + 1], strict=False))
+        except json.JSONDecodeError:
+            pass
+    error = JsonExtractionError("No JSON object in response")
+    for _ in range(MAX_CANDIDATES):
+        if start < 0:
+            break
+        end, cut = _scan(text, start)
+        if end is None:
+            if cut is None:
+                raise JsonExtractionError("Response truncated before the first complete value")
+            cut_at, still_open = cut
+            body = text[start:cut_at] + "".join(_CLOSERS[char] for char in reversed(still_open))
+            return _load(body, ("truncated",))
+        try:
+            return _load(text[start:end])
+        except JsonExtractionError as e:
+            error = e
+        start = text.find("{", start + 1)
+    raise error
+
+
+class ItemStream:
+    """Incremental parser yielding each object inside the root object's arrays as soon as it closes.
+
+    For '{"questions": [{...}, {...}]}' every question is returned by the feed() call that completes it.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.position = 0
+        self.stack: List[str] = []
+        self.in_string = False
+        self.escaped = False
+        self.item_start: Optional[int] = None
+        self.failed = 0
+
+    def feed(self, chunk: str) -> List[Any]:
+        self.buffer += chunk
+        items = []
+        stack = self.stack
+        buffer = self.buffer
+        for index in range(self.position, len(buffer)):
+            char = buffer[index]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+            elif not stack:
+                # Fences and prose before the root object are skipped.
+                if char == "{":
+                    stack.append(char)
+            elif char == '"':
+                self.in_string = True
+            elif char in "{[":
+                stack.append(char)
+                if char == "{" and len(stack) == 3 and stack[1] == "[":
+                    self.item_start = index
+            elif char in "}]":
+                stack.pop()
+                if self.item_start is not None and len(stack) == 2:
+                    try:
+                        items.append(_load(buffer[self.item_start:index + 1]).value)
+                    except JsonExtractionError:
+                        self.failed += 1
+                    self.item_start = None
+        # Only an unfinished item needs its text kept.
+        keep = self.item_start if self.item_start is not None else len(buffer)
+        self.buffer = buffer[keep:]
+        self.position = len(buffer) - keep
+        if self.item_start is not None:
+            self.item_start = 0
+        return items
@@ -0,0 +1,458 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+from collections import deque
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+from llm_client import RETRYABLE_STATUS, LLMClient, LLMError
+from log import get_logger
+from tokens import count_tokens
+from metrics import LLM_ERRORS, LLM_FIRST_TOKEN_SECONDS, LLM_GENERATION_SECONDS, LLM_HEDGES, LLM_QUEUE_WAIT_SECONDS
+
+logger = get_logger(__name__)
+
+PRIORITY_LESSON = 0
+PRIORITY_ASSESSMENT = 1
+PRIORITY_FEEDBACK = 2
+PRIORITY_SUMMARY = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_LESSON: "lesson",
+    PRIORITY_ASSESSMENT: "assessment",
+    PRIORITY_FEEDBACK: "feedback",
+    PRIORITY_SUMMARY: "summary",
+}
+
+DEFAULT_DEADLINES = {
+    PRIORITY_LESSON: 15.0,
+    PRIORITY_ASSESSMENT: 60.0,
+    PRIORITY_FEEDBACK: 120.0,
+    PRIORITY_SUMMARY: 300.0,
+}
+
+# Budget for a dispatched call, retries included; the deadlines above only bound time spent queued.
+DEFAULT_TIMEOUTS = {
+    PRIORITY_LESSON: 30.0,
+    PRIORITY_ASSESSMENT: 60.0,
+    PRIORITY_FEEDBACK: 45.0,
+    PRIORITY_SUMMARY: 60.0,
+}
+
+DEFAULT_HEDGED = "lesson"
+
+
+class LLMShed(LLMError):
+    pass
+
+
+class LLMDeadline(LLMError):
+    pass
+
+
+class LLMCircuitOpen(LLMError):
+    pass
+
+
+class _LeaderCancelled(LLMError):
+    pass
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    return count_tokens(prompt) + max_tokens
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float):
+        self.tokens -= min(amount, self.capacity)
+
+
+class CircuitBreaker:
+    """Opens after consecutive provider failures; after a cooldown one probe call decides whether to close."""
+
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started: Optional[float] = None
+        self.stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        now = time.monotonic()
+        # A probe that never reported back (cancelled, shed) stops blocking after another cooldown.
+        if state == "half_open" and (self.probe_started is None or now - self.probe_started >= self.cooldown):
+            self.probe_started = now
+            return True
+        self.stats["rejected"] += 1
+        return False
+
+    def record_success(self):
+        if self.opened_at is not None:
+            logger.info("LLM circuit closed")
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.stats["opened"] += 1
+                logger.warning("LLM circuit opened after %d consecutive failures", self.failures)
+            self.opened_at = time.monotonic()
+            self.probe_started = None
+
+    def snapshot(self) -> dict:
+        return {"state": self.state, "failures": self.failures, **self.stats}
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "future", "enqueued_at", "cancelled")
+
+    def __init__(self, priority: int, seq: int, tokens: int, future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.cancelled = False
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class LLMScheduler:
+    """Single gate for every LLM call: priority queue, RPM/TPM buckets, concurrency cap and coalescing."""
+
+    def __init__(self, client: LLMClient, requests_per_minute: int = 500, tokens_per_minute: int = 200000,
+                 max_concurrency: int = 16, deadlines: Optional[Dict[int, float]] = None,
+                 timeouts: Optional[Dict[int, float]] = None, hedged: Iterable[int] = (PRIORITY_LESSON,),
+                 hedge_quantile: float = 0.95, hedge_min_delay: float = 1.0, hedge_min_samples: int = 20,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_concurrency = max_concurrency
+        self.deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+        self.timeouts = {**DEFAULT_TIMEOUTS, **(timeouts or {})}
+        self.hedged = set(hedged)
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.breaker = breaker or CircuitBreaker()
+        self.active = 0
+        self._heap = []
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: Dict[tuple, asyncio.Future] = {}
+        self.stats = {
+            name: {"queued": 0, "served": 0, "shed": 0, "coalesced": 0, "wait_total": 0.0, "wait_max": 0.0,
+                   "recent_waits": deque(maxlen=256),
+                   "deadline": 0, "hedge_fired": 0, "hedge_won": 0, "hedge_skipped": 0,
+                   "recent_latencies": deque(maxlen=256)}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    @classmethod
+    def from_env(cls, client: LLMClient) -> "LLMScheduler":
+        deadlines, timeouts = {}, {}
+        for priority, name in PRIORITY_NAMES.items():
+            value = os.getenv(f"LLM_DEADLINE_{name.upper()}")
+            if value:
+                deadlines[priority] = float(value)
+            value = os.getenv(f"LLM_TIMEOUT_{name.upper()}")
+            if value:
+                timeouts[priority] = float(value)
+        hedged = {name.strip() for name in os.getenv("LLM_HEDGE", DEFAULT_HEDGED).split(",") if name.strip()}
+        return cls(
+            client,
+            requests_per_minute=int(os.getenv("LLM_RPM", "500")),
+            tokens_per_minute=int(os.getenv("LLM_TPM", "200000")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+            deadlines=deadlines,
+            timeouts=timeouts,
+            hedged=[priority for priority, name in PRIORITY_NAMES.items() if name in hedged],
+            hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", "0.95")),
+            hedge_min_delay=float(os.getenv("LLM_HEDGE_MIN_DELAY", "1")),
+            breaker=CircuitBreaker(
+                failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30")),
+            ),
+        )
+
+    @property
+    def degraded(self) -> bool:
+        return self.breaker.state == "open"
+
+    def _wake(self):
+        self._timer = None
+        while self._heap and self.active < self.max_concurrency:
+            waiter = self._heap[0]
+            if waiter.cancelled or waiter.future.done():
+                heapq.heappop(self._heap)
+                continue
+            delay = max(self.requests.wait_time(1), self.tokens.wait_time(waiter.tokens))
+            if delay > 0:
+                # Strict priority: lower classes never overtake a throttled higher one.
+                self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+                return
+            heapq.heappop(self._heap)
+            self.requests.take(1)
+            self.tokens.take(waiter.tokens)
+            self.active += 1
+            waiter.future.set_result(True)
+
+    async def acquire(self, priority: int, tokens: int):
+        name = PRIORITY_NAMES[priority]
+        stats = self.stats[name]
+        waiter = _Waiter(priority, next(self._seq), tokens, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, waiter)
+        stats["queued"] += 1
+        if self._timer is None:
+            self._wake()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.deadlines[priority])
+        except asyncio.TimeoutError:
+            waiter.cancelled = True
+            if waiter.future.done():
+                self.release()
+            stats["shed"] += 1
+            LLM_ERRORS.inc("shed")
+            raise LLMShed(f"{name} request shed after waiting {self.deadlines[priority]}s in queue")
+        except asyncio.CancelledError:
+            waiter.cancelled = True
+            if waiter.future.done():
+                self.release()
+            raise
+        waited = time.monotonic() - waiter.enqueued_at
+        stats["served"] += 1
+        stats["wait_total"] += waited
+        stats["wait_max"] = max(stats["wait_max"], waited)
+        stats["recent_waits"].append(waited)
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, name)
+
+    def try_acquire(self, tokens: int) -> bool:
+        """Take a slot only if it is free right now and nobody is queued; hedges never delay real requests."""
+        if self.active >= self.max_concurrency or self.queue_depth_total():
+            return False
+        if self.requests.wait_time(1) > 0 or self.tokens.wait_time(tokens) > 0:
+            return False
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        if self._timer is None:
+            self._wake()
+
+    def hedge_delay(self, priority: int) -> float:
+        latencies = self.stats[PRIORITY_NAMES[priority]]["recent_latencies"]
+        if len(latencies) < self.hedge_min_samples:
+            return max(self.hedge_min_delay, self.timeouts[priority] / 2)
+        ordered = sorted(latencies)
+        return max(self.hedge_min_delay, ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_quantile))])
+
+    def _record(self, error: LLMError):
+        # Rate limits, 5xx, transport errors and deadlines mean the provider is struggling; a 400 does not.
+        if isinstance(error, LLMDeadline) or error.status_code is None or error.status_code in RETRYABLE_STATUS:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def _deadline(self, priority: int) -> LLMDeadline:
+        name = PRIORITY_NAMES[priority]
+        self.stats[name]["deadline"] += 1
+        LLM_ERRORS.inc("deadline")
+        return LLMDeadline(f"{name} request missed its {self.timeouts[priority]}s deadline")
+
+    def _check_circuit(self, priority: int):
+        if not self.breaker.allow():
+            LLM_ERRORS.inc("circuit_open")
+            raise LLMCircuitOpen(f"LLM circuit open; {PRIORITY_NAMES[priority]} request failed fast")
+
+    async def _generate(self, priority: int, prompt: str, temperature: float, max_tokens: int, tokens: int) -> str:
+        """Run the call; if it outlives the class's recent p95, race a second attempt and keep the first answer."""
+        name = PRIORITY_NAMES[priority]
+        stats = self.stats[name]
+        started = time.perf_counter()
+
+        def attempt() -> asyncio.Task:
+            task = asyncio.create_task(self.client.complete(prompt, temperature=temperature, max_tokens=max_tokens))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            return task
+
+        primary = attempt()
+        pending = {primary}
+        hedge = None
+        try:
+            if priority in self.hedged:
+                await asyncio.wait(pending, timeout=self.hedge_delay(priority))
+                if not primary.done():
+                    if self.try_acquire(tokens):
+                        hedge = attempt()
+                        hedge.add_done_callback(lambda t: self.release())
+                        pending.add(hedge)
+                        stats["hedge_fired"] += 1
+                        LLM_HEDGES.inc(name, "fired")
+                    else:
+                        stats["hedge_skipped"] += 1
+                        LLM_HEDGES.inc(name, "skipped")
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            stats["hedge_won"] += 1
+                            LLM_HEDGES.inc(name, "won")
+                        stats["recent_latencies"].append(time.perf_counter() - started)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def complete(self, prompt: str, priority: int = PRIORITY_LESSON, temperature: float = 0.7,
+                       max_tokens: int = 2000) -> str:
+        key = (prompt, temperature, max_tokens)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats[PRIORITY_NAMES[priority]]["coalesced"] += 1
+            try:
+                return await asyncio.shield(pending)
+            except _LeaderCancelled:
+                # The caller that owned the request went away; make our own.
+                pass
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            self._check_circuit(priority)
+            tokens = estimate_tokens(prompt, max_tokens)
+            await self.acquire(priority, tokens)
+            try:
+                with LLM_GENERATION_SECONDS.time(PRIORITY_NAMES[priority], "complete"):
+                    try:
+                        content = await asyncio.wait_for(self._generate(priority, prompt, temperature, max_tokens, tokens),
+                                                         timeout=self.timeouts[priority])
+                    except asyncio.TimeoutError:
+                        raise self._deadline(priority) from None
+            except LLMError as e:
+                self._record(e)
+                raise
+            finally:
+                self.release()
+            self.breaker.record_success()
+            future.set_result(content)
+            return content
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else _LeaderCancelled("LLM request cancelled"))
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    async def stream(self, prompt: str, priority: int = PRIORITY_LESSON, temperature: float = 0.7,
+                     max_tokens: int = 2000) -> AsyncIterator[str]:
+        self._check_circuit(priority)
+        await self.acquire(priority, estimate_tokens(prompt, max_tokens))
+        name = PRIORITY_NAMES[priority]
+        started = time.perf_counter()
+        deltas = self.client.stream(prompt, temperature=temperature, max_tokens=max_tokens)
+        try:
+            # Streams are not hedged; the deadline bounds the wait for the first delta, the client's read
+            # timeout bounds stalls after that.
+            try:
+                delta = await asyncio.wait_for(deltas.__anext__(), timeout=self.timeouts[priority])
+            except StopAsyncIteration:
+                delta = None
+            except asyncio.TimeoutError:
+                raise self._deadline(priority) from None
+            if delta is not None:
+                LLM_FIRST_TOKEN_SECONDS.observe(time.perf_counter() - started, name)
+                yield delta
+                async for delta in deltas:
+                    yield delta
+            LLM_GENERATION_SECONDS.observe(time.perf_counter() - started, name, "stream")
+        except LLMError as e:
+            self._record(e)
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            await deltas.aclose()
+            self.release()
+
+    def queue_depth_total(self) -> int:
+        return sum(1 for waiter in self._heap if not waiter.cancelled and not waiter.future.done())
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        for waiter in self._heap:
+            if not waiter.cancelled and not waiter.future.done():
+                depth[PRIORITY_NAMES[waiter.priority]] += 1
+        return depth
+
+    def snapshot(self) -> dict:
+        classes = {}
+        for priority, name in PRIORITY_NAMES.items():
+            stats = self.stats[name]
+            waits = sorted(stats["recent_waits"])
+            classes[name] = {
+                "queued": stats["queued"],
+                "served": stats["served"],
+                "shed": stats["shed"],
+                "coalesced": stats["coalesced"],
+                "wait_avg": round(stats["wait_total"] / stats["served"], 4) if stats["served"] else 0.0,
+                "wait_max": round(stats["wait_max"], 4),
+                "wait_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4) if waits else 0.0,
+                "timeout": self.timeouts[priority],
+                "deadline_exceeded": stats["deadline"],
+                "hedged": priority in self.hedged,
+                "hedge_delay": round(self.hedge_delay(priority), 4),
+                "hedge_fired": stats["hedge_fired"],
+                "hedge_won": stats["hedge_won"],
+                "hedge_skipped": stats["hedge_skipped"],
+                "hedge_fire_rate": round(stats["hedge_fired"] / stats["served"], 4) if stats["served"] else 0.0,
+                "hedge_win_rate": round(stats["hedge_won"] / stats["hedge_fired"], 4) if stats["hedge_fired"] else 0.0,
+            }
+        return {
+            "active": self.active,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth(),
+            "circuit": self.breaker.snapshot(),
+            "classes": classes,
+        }
@@ -1,22 +1,77 @@
 import os
-import json
 import uuid
+import secrets
 import time
-import re
-import redis.asyncio as redis
-import requests
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+import asyncio
+from fastapi import Depends, FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
-from typing import Dict, List
+from typing import List, Optional
 from dotenv import load_dotenv
+from redis_pool import RedisProvider
+from llm_client import LLMClient, LLMError
+from llm_scheduler import PRIORITY_ASSESSMENT, PRIORITY_FEEDBACK, PRIORITY_LESSON, PRIORITY_SUMMARY, LLMScheduler
+from lesson_cache import LessonCache
+from question_bank import QuestionBank
+from analytics import read_analytics, record_result, record_topic
+from connections import ConnectionManager, current_connection
+from conversations import append_history, get_conversation_history, list_conversations, record_conversation
+from chat_context import ChatContext, render_turns
+from dispatcher import MessageDispatcher, current_dispatcher
+from intent import LESSON, QUESTION, QUIZ_REQUEST, casual_reply, classify, quiz_topic, refers_back
+from grading import cached_explanations, grade_assessment, parse_explanations, store_explanations
+from topics import extract_topic, topic_key
+import codec
+from log import configure_logging, current_trace, get_logger
+from metrics import LLM_CIRCUIT_OPEN, LLM_PARSE_SECONDS, LLM_QUEUE_DEPTH, WS_MESSAGE_SECONDS, WS_MESSAGES, render as render_metrics
 
 load_dotenv()
+configure_logging()
+logger = get_logger("main")
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")  # Default fallback
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "48"))
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+LESSON_PROMPT_VERSION = "v1"
+QUESTION_BANK_BATCH = int(os.getenv("QUESTION_BANK_BATCH", "6"))
+LLM_ERROR_REPLY = "Sorry, I couldn't generate a response at the moment."
+
+
+class PartialReply(str):
+    """Text of a streamed reply that broke off; shown to the user but never cached or remembered."""
+
+
+def complete_reply(content: str) -> bool:
+    return bool(content) and content != LLM_ERROR_REPLY and not isinstance(content, PartialReply)
+
+
+MESSAGE_TYPES = {"start_lesson", "chat_message", "message", "start_assessment", "submit_assessment"}
 
 app = FastAPI()
+redis_provider = RedisProvider(REDIS_URL)
+llm_client = LLMClient()
+llm_scheduler = LLMScheduler.from_env(llm_client)
+lesson_cache = LessonCache.from_env(
+    model=llm_client.settings.model,
+    prompt_version=LESSON_PROMPT_VERSION,
+    cacheable=complete_reply,
+)
+question_bank = QuestionBank.from_env()
+chat_context = ChatContext.from_env()
+background_tasks = set()
+
+async def get_redis():
+    return redis_provider.client
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    # Without a configured token the admin endpoints stay closed rather than open to anyone.
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin endpoints are disabled; set ADMIN_TOKEN")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Admin token required")
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,13 +85,22 @@ app.add_middleware(
 @app.get("/")
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "message": "Tutor Agent API is running"}
+    await redis_provider.check()
+    return {"status": "healthy", "message": "Tutor Agent API is running", "redis": redis_provider.mode}
 
 @app.on_event("startup")
 async def startup_event():
-    print("Starting up Tutor Agent API...")
-    print(f"OpenAI API Key configured: {'Yes' if OPENAI_API_KEY else 'No'}")
-    print(f"Redis URL: {REDIS_URL}")
+    logger.info("Starting up Tutor Agent API (OpenAI API key configured: %s, Redis URL: %s)",
+                "yes" if OPENAI_API_KEY else "no", REDIS_URL)
+    await redis_provider.startup()
+    await llm_client.startup()
+    await manager.start(redis_provider)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await manager.stop()
+    await llm_client.shutdown()
+    await redis_provider.shutdown()
 
 class UserLogin(BaseModel):
     email: str
@@ -48,102 +112,53 @@ class UserCreate(BaseModel):
     password: str
 
 
-class ConnectionManager:
-    def __init__(self):
-        self.connections: Dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: str):
-        await websocket.accept()
-        self.connections[user_id] = websocket
-
-    def disconnect(self, user_id: str):
-        self.connections.pop(user_id, None)
-
-    async def send(self, user_id: str, message: dict):
-        websocket = self.connections.get(user_id)
-        if websocket:
-            await websocket.send_json(message)
-
-manager = ConnectionManager()
-
-async def call_openai(prompt: str) -> str:
-    import asyncio
-    
-    headers = {
-        "Authorization": f"Bearer {OPENAI_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    payload = {
-        "model": "gpt-3.5-turbo",
-        "messages": [{"role": "user", "content": prompt}],
-        "temperature": 0.7,
-        "max_tokens": 2000  
-    }
-    
-    # Using requests instead of httpx for better deployment compatibility
-    response = await asyncio.to_thread(requests.post, 
-                                     "https://api.openai.com/v1/chat/completions",
-                                     headers=headers, 
-                                     json=payload,
-                                     timeout=30)
-    
-    if response.status_code == 200:
-        data = response.json()
-        return data["choices"][0]["message"]["content"]
-    else:
-        print(f"OpenAI API Error: {response.status_code} - {response.text}")
-        return "Sorry, I couldn't generate a response at the moment."
+manager = ConnectionManager.from_env()
 
-async def handle_message(user_id: str, msg: dict, manager: ConnectionManager):
-    print(f"Handling message for {user_id}: {msg}")
-    
-    # Make Redis connection optional for deployment
-    rdb = None
+async def call_openai(prompt: str, on_delta=None, priority: int = PRIORITY_LESSON) -> str:
+    chunks = []
     try:
-        rdb = redis.from_url(REDIS_URL, decode_responses=True)
-        await rdb.ping()  # Test connection
-    except Exception as e:
-        print(f"Redis connection failed: {e}. Continuing without Redis.")
-        rdb = None
-
-
-    if msg["type"] in ["start_lesson", "chat_message", "message"]:
-        topic = msg.get("topic") or msg.get("message") or msg.get("content")
-        
-        # Only store non-casual conversations
-        casual_words = ["hi", "hello", "hey", "thanks", "thank you", "bye", "goodbye", "ok", "okay"]
-        if not (any(word in topic.lower().strip() for word in casual_words) and len(topic.split()) <= 3):
-            conversation_id = str(uuid.uuid4())
-            conversation = {
-                "id": conversation_id,
-                "title": topic[:50] + "..." if len(topic) > 50 else topic,
-                "topic": topic,
-                "timestamp": str(int(time.time())),
-                "user_id": user_id
-            }
-            
-            user_conversations = await rdb.get(f"user_conversations:{user_id}")
-            conversations = json.loads(user_conversations) if user_conversations else []
-            conversations.insert(0, conversation)
-            conversations = conversations[:20] 
-            await rdb.setex(f"user_conversations:{user_id}", 2592000, json.dumps(conversations))
-
-    if (msg["type"] == "start_lesson" and msg.get("topic")) or (msg["type"] == "chat_message" and msg.get("message")) or (msg["type"] == "message" and msg.get("content")):
-        raw_topic = msg.get("topic") or msg.get("message") or msg.get("content")
-        print(f"Processing raw input: {raw_topic}")
-    
-        casual_words = ["hi", "hello", "hey", "thanks", "thank you", "bye", "goodbye", "ok", "okay"]
-        if any(word in raw_topic.lower().strip() for word in casual_words) and len(raw_topic.split()) <= 3:
-            
-            casual_prompt = f"Respond briefly and friendly to this casual message: {raw_topic}. Keep it conversational and helpful."
-            content = await call_openai(casual_prompt)
-            await manager.send(user_id, {"type": "message", "content": content})
-        else:
-            
-            await manager.send(user_id, {"type": "typing", "content": "Thinking..."})
-            
-            
-            lesson_prompt = f"""Respond to this user request: "{raw_topic}"
+        if on_delta is None:
+            return await llm_scheduler.complete(prompt, priority=priority)
+        async for delta in llm_scheduler.stream(prompt, priority=priority):
+            chunks.append(delta)
+            await on_delta(delta)
+        return "".join(chunks)
+    except LLMError as e:
+        logger.warning("OpenAI API error: %s", e)
+        if chunks:
+            return PartialReply("".join(chunks))
+        return LLM_ERROR_REPLY
+
+async def stream_reply(user_id: str, prompt: str, manager: ConnectionManager, priority: int = PRIORITY_LESSON) -> str:
+    # Deltas are batched so the socket sees a frame every STREAM_FLUSH_CHARS
+    # characters or STREAM_FLUSH_INTERVAL seconds, whichever comes first.
+    message_id = str(uuid.uuid4())
+    pending = []
+    state = {"size": 0, "flushed_at": 0.0}
+
+    async def flush():
+        if pending:
+            await manager.send(user_id, {"type": "message_delta", "id": message_id, "content": "".join(pending)})
+            pending.clear()
+            state["size"] = 0
+        state["flushed_at"] = time.monotonic()
+
+    async def on_delta(delta: str):
+        pending.append(delta)
+        state["size"] += len(delta)
+        if state["size"] >= STREAM_FLUSH_CHARS or time.monotonic() - state["flushed_at"] >= STREAM_FLUSH_INTERVAL:
+            await flush()
+
+    content = await call_openai(prompt, on_delta=on_delta, priority=priority)
+    await flush()
+    done = {"type": "message_done", "id": message_id, "content": content}
+    if isinstance(content, PartialReply):
+        done["partial"] = True
+    await manager.send(user_id, done)
+    return content
+
+def build_lesson_prompt(raw_topic: str) -> str:
+    return f"""Respond to this user request: "{raw_topic}"
 
 If it's asking to learn about a topic, teach it in 5 clear steps:
 - Basic definition and concept
@@ -155,49 +170,10 @@ If it's asking to learn about a topic, teach it in 5 clear steps:
 If it's a general question, provide a helpful and educational answer.
 Keep responses clear and educational."""
 
-            print(f"Calling OpenAI with prompt for: {raw_topic}")
-            content = await call_openai(lesson_prompt)
-            print(f"Generated content: {content[:200]}...")
-            
-            await manager.send(user_id, {"type": "message", "content": content})
-            
-            topic = raw_topic.lower()
-            topic = re.sub(r'^(explain|tell|teach|show|what|how|where|when|why|can you)\s+(me\s+)?(about\s+)?', '', topic)
-            topic = re.sub(r'^(is|are|does|do)\s+', '', topic)
-            topic = re.sub(r'\?+$', '', topic)  
-            
-            topic = topic.strip()
-            if len(topic.split()) > 6:
-                topic = " ".join(topic.split()[:6])
-            
-            if not topic or len(topic) < 3:
-                topic = raw_topic.strip()
-                if len(topic.split()) > 4:
-                    topic = " ".join(topic.split()[:4])
-            
-            print(f"DEBUG: Extracted topic: '{topic}' from raw input: '{raw_topic}'")
-            
-    
-            if not any(avoid in raw_topic.lower() for avoid in ["hello", "hi", "thanks", "thank you", "bye", "goodbye", "ok", "okay"]):
-                print(f"DEBUG: Sending assessment offer for topic: '{topic}'")
-                await manager.send(user_id, {
-                    "type": "assessment_offer",
-                    "topic": topic,
-                    "content": f"Would you like to take a quick test?"
-                })
-            else:
-                print(f"DEBUG: NOT sending assessment offer - casual greeting detected")
+def build_assessment_prompt(topic: str, count: int = QUESTION_BANK_BATCH) -> str:
+    return f"""Create {count} multiple choice questions about "{topic}".
 
-    elif msg["type"] == "start_assessment" and msg.get("topic"):
-        print(f"DEBUG: Received start_assessment request for topic: {msg.get('topic')}")
-        topic = msg["topic"]
-        
-        topic_key = topic.replace(' ', '_').lower()
-        await rdb.delete(f"assessment:{user_id}:{topic_key}")
-    
-        assessment_prompt = f"""Create 3 multiple choice questions about "{topic}".
-
-Each question should test understanding of {topic}. Return JSON format:
+Each question should test understanding of {topic} and cover a different aspect of it. Return JSON format:
 
 {{
   "questions": [
@@ -207,58 +183,215 @@ Each question should test understanding of {topic}. Return JSON format:
       "options": ["[real option A]", "[real option B]", "[real option C]", "[real option D]"],
       "correct_answer": "[correct option text]"
     }},
-    {{
-      "id": "q2", 
-      "question": "[different question about {topic}]",
-      "options": ["[real option A]", "[real option B]", "[real option C]", "[real option D]"],
-      "correct_answer": "[correct option text]"
-    }},
-    {{
-      "id": "q3",
-      "question": "[third question about {topic}]",
-      "options": ["[real option A]", "[real option B]", "[real option C]", "[real option D]"],
-      "correct_answer": "[correct option text]"
-    }}
+    ... {count} questions in total, ids q1 to q{count}
   ]
 }}
 
 Make questions specific and educational about {topic}."""
 
-        try:
+def spawn(coro):
+    # Not tied to the connection's dispatcher: feedback is stored with the result, so it should finish
+    # even if the user disconnects first.
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+def prefetch_questions(rdb, topic: str):
+    return question_bank.prefetch(rdb, topic, lambda on_delta: call_openai(
+        build_assessment_prompt(topic), on_delta=on_delta, priority=PRIORITY_ASSESSMENT))
+
+def build_explanation_prompt(topic: str, items: List[dict]) -> str:
+    questions = "\n".join(
+        f"""\nQuestion id: {item["id"]}
+Question: {item["question"]}
+Correct Answer: {item["correct_answer"]}"""
+        for item in items
+    )
+    return f"""Explain the correct answer to each of these multiple choice questions about "{topic}".
+{questions}
+
+Return JSON format:
+{{
+  "explanations": [
+    {{"id": "<question id>", "explanation": "<2-3 sentence explanation of why the correct answer is right>"}}
+  ]
+}}
+
+Be specific and educational. Focus on helping the user learn."""
+
+def build_summary_prompt(summary: str, turns: List[dict]) -> str:
+    return f"""Update the running summary of a tutoring conversation.
+
+Current summary:
+{summary or "(none yet)"}
+
+New turns to fold in:
+{render_turns(turns)}
+
+Write a concise summary of at most {chat_context.summary_tokens * 3 // 4} words covering the topics taught, what the
+student asked, and anything they found difficult. Return only the summary."""
+
+async def summarize_turns(summary: str, turns: List[dict]) -> str:
+    return await llm_scheduler.complete(build_summary_prompt(summary, turns), priority=PRIORITY_SUMMARY,
+                                        temperature=0.3, max_tokens=chat_context.summary_tokens)
+
+async def remember_exchange(rdb, user_id: str, message: str, reply: str):
+    turns = await chat_context.append(rdb, user_id, [("user", message), ("tutor", reply)])
+    if chat_context.needs_compaction(turns):
+        # Older turns are summarized off the request path so the next prompt stays within budget.
+        chat_context.schedule_compaction(rdb, user_id, summarize_turns)
+    timestamp = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    await append_history(rdb, user_id, message, [
+        {"type": "user", "content": message, "timestamp": timestamp},
+        {"type": "tutor", "content": reply, "timestamp": timestamp},
+    ])
+
+async def send_assessment_feedback(user_id: str, assessment_id: str, result: dict, manager: ConnectionManager, rdb):
+    # Explanations depend only on the question, so they are cached per question and
+    # the LLM is asked only for the ones that have never been explained before.
+    feedback = result["feedback"]
+    try:
+        cached = await cached_explanations(rdb, feedback)
+        explanations = {item["id"]: text for item, text in zip(feedback, cached) if text}
+        for item in feedback:
+            if item["id"] not in explanations and item.get("explanation"):
+                explanations[item["id"]] = item["explanation"]
+        missing = [item for item in feedback if item["id"] not in explanations]
+        if missing:
+            explanation_prompt = build_explanation_prompt(result["topic"], missing)
+            response = await call_openai(explanation_prompt, priority=PRIORITY_FEEDBACK)
+            started = time.perf_counter()
+            try:
+                generated, repairs = parse_explanations(response)
+            except ValueError:
+                LLM_PARSE_SECONDS.observe(time.perf_counter() - started, "explanations", "rejected")
+                raise
+            LLM_PARSE_SECONDS.observe(time.perf_counter() - started, "explanations", "repaired" if repairs else "ok")
+            await store_explanations(rdb, missing, generated)
+            explanations.update(generated)
+
+        for item in feedback:
+            item["explanation"] = explanations.get(item["id"], item.get("explanation", ""))
+        result_key = f"assessment_result:{user_id}:{assessment_id}"
+        if await rdb.exists(result_key):
+            await rdb.setex(result_key, 3600, codec.dumps(result))
+        await manager.send(user_id, {
+            "type": "assessment_feedback",
+            "assessment_id": assessment_id,
+            "feedback": feedback,
+            "overall_feedback": result["overall_feedback"],
+        })
+    except Exception as e:
+        logger.error("Assessment feedback failed for %s: %s", assessment_id, e)
+
+async def handle_message(user_id: str, msg: dict, manager: ConnectionManager, rdb):
+    logger.debug("Handling %s message for %s", msg["type"], user_id)
+
+    intent = None
+    if msg["type"] in ["start_lesson", "chat_message", "message"]:
+        topic = msg.get("topic") or msg.get("message") or msg.get("content")
+        
+        # Only store lessons and questions, not casual messages or quiz requests
+        intent = classify(topic) if topic else None
+        if intent and intent.name in (LESSON, QUESTION):
+            await record_conversation(rdb, user_id, topic)
+            # "tell me more about it" names no topic of its own.
+            if not refers_back(topic):
+                await record_topic(rdb, user_id, extract_topic(topic))
+
+    if (msg["type"] == "start_lesson" and msg.get("topic")) or (msg["type"] == "chat_message" and msg.get("message")) or (msg["type"] == "message" and msg.get("content")):
+        raw_topic = msg.get("topic") or msg.get("message") or msg.get("content")
+        logger.debug("Classified input as %s: %.200s", intent.name, raw_topic)
     
-            print(f"Generating assessment for topic: {topic}")
-            questions_response = await call_openai(assessment_prompt)
-            print(f"AI Response: {questions_response[:200]}...")
-            
+        if intent.casual:
+            content = casual_reply(intent.name)
+            if msg.get("stream"):
+                await manager.send(user_id, {"type": "message_done", "id": str(uuid.uuid4()), "content": content})
+            else:
+                await manager.send(user_id, {"type": "message", "content": content})
+        elif intent.name == QUIZ_REQUEST:
+            quiz = quiz_topic(raw_topic)
+            if quiz:
+                await handle_message(user_id, {"type": "start_assessment", "topic": extract_topic(quiz)}, manager, rdb)
+            else:
+                await manager.send(user_id, {"type": "message", "content": "Sure! Which topic would you like to be quizzed on?"})
+        else:
+            dispatcher = current_dispatcher.get()
+            if dispatcher is not None:
+                dispatcher.begin_generation()
+            if not msg.get("stream"):
+                await manager.send(user_id, {"type": "typing", "content": "Thinking..."})
             
-            questions_json = questions_response.strip()
-            if questions_json.startswith('```json'):
-                questions_json = questions_json[7:-3].strip()
-            elif questions_json.startswith('```'):
-                questions_json = questions_json[3:-3].strip()
             
-            print(f"Cleaned JSON: {questions_json[:200]}...")
-            questions_data = json.loads(questions_json)
+            lesson_prompt = build_lesson_prompt(raw_topic)
+
+            # Follow-ups see the conversation so far and are never served from or written to the shared cache;
+            # standalone lessons stay cacheable.
+            shareable = not refers_back(raw_topic)
+            context = await chat_context.prompt_context(rdb, user_id) if intent.name == QUESTION or not shareable else ""
+            if context:
+                lesson_prompt = f"{context}\n\n{lesson_prompt}"
+
+            async def generate_lesson():
+                if msg.get("stream"):
+                    return await stream_reply(user_id, lesson_prompt, manager)
+                content = await call_openai(lesson_prompt)
+                await manager.send(user_id, {"type": "message", "content": content})
+                return content
+
+            topic = extract_topic(raw_topic)
             
-            if "questions" in questions_data and len(questions_data["questions"]) >= 1:
-                assessment = {
-                    "id": str(uuid.uuid4()),
-                    "topic": topic,
-                    "questions": questions_data["questions"],
-                    "timestamp": str(int(time.time()))
-                }
-                print(f"Successfully generated AI assessment with {len(questions_data['questions'])} questions")
+            logger.debug("Extracted topic '%s'", topic)
+            # Fill the question bank while the lesson is generated so start_assessment can answer at once;
+            # a follow-up's extracted "topic" ("more about it") is not worth a bank of its own.
+            if shareable:
+                prefetch_questions(rdb, topic)
+
+            if context or not shareable:
+                # While the provider is failing fast, a cached lesson on the topic beats an error reply.
+                content = await lesson_cache.get(rdb, raw_topic) if shareable and llm_scheduler.degraded else None
+                content, cached = (content, True) if content else (await generate_lesson(), False)
             else:
-                print(f"AI response invalid: {questions_data}")
-                raise ValueError("Invalid AI response format")
-                
-        except Exception as e:
-            print(f"Error generating AI questions: {e}")
-            print("Using fallback questions")
+                content, cached = await lesson_cache.get_or_generate(rdb, raw_topic, generate_lesson)
+            if cached:
+                if msg.get("stream"):
+                    await manager.send(user_id, {"type": "message_done", "id": str(uuid.uuid4()), "content": content})
+                else:
+                    await manager.send(user_id, {"type": "message", "content": content})
+            logger.debug("Lesson for '%s' ready (%d chars, cached: %s)", topic, len(content), cached)
+            if complete_reply(content):
+                await remember_exchange(rdb, user_id, raw_topic, content)
     
+            if shareable:
+                await manager.send(user_id, {
+                    "type": "assessment_offer",
+                    "topic": topic,
+                    "content": f"Would you like to take a quick test?"
+                })
+
+    elif msg["type"] == "start_assessment" and msg.get("topic"):
+        topic = msg["topic"]
+        
+        await rdb.delete(f"assessment:{user_id}:{topic_key(topic)}")
+        
+        assessment = await question_bank.sample(rdb, topic)
+        if assessment is None:
+            logger.info("Question bank empty for topic '%s', generating now", topic)
+            # Sample as soon as enough questions have streamed in; the rest of the batch keeps filling the bank.
+            await question_bank.wait_for_questions(rdb, topic, prefetch_questions(rdb, topic))
+            assessment = await question_bank.sample(rdb, topic)
+        if assessment is None:
+            await manager.send(user_id, {"type": "error", "content": "Failed to create assessment"})
+            return
+        assessment["timestamp"] = str(int(time.time()))
+        logger.debug("Sampled %d questions for topic '%s'", len(assessment["questions"]), topic)
+        if await question_bank.size(rdb, topic) < question_bank.target_size:
+            prefetch_questions(rdb, topic)
+
         try:
-            await rdb.setex(f"assessment:{user_id}:{topic.replace(' ', '_').lower()}", 3600, json.dumps(assessment))
-            await rdb.setex(f"assessment:{assessment['id']}", 3600, json.dumps(assessment))
+            await rdb.setex(f"assessment:{user_id}:{topic_key(topic)}", 3600, codec.dumps(assessment))
+            await rdb.setex(f"assessment:{assessment['id']}", 3600, codec.dumps(assessment))
             await manager.send(user_id, {"type": "assessment", "assessment": assessment})
         except Exception as e:
             await manager.send(user_id, {"type": "error", "content": "Failed to create assessment"})
@@ -267,227 +400,134 @@ Make questions specific and educational about {topic}."""
         assessment_id = msg["assessment_id"]
         user_answers = msg["answers"]
         
-        print(f"Processing assessment submission: {assessment_id}")
-        print(f"User answers: {user_answers}")
+        logger.debug("Processing assessment submission %s", assessment_id)
         
         try:
         
             assessment_data = await rdb.get(f"assessment:{assessment_id}")
-            print(f"Assessment data found: {assessment_data is not None}")
             if not assessment_data:
-                print("Assessment not found in Redis")
+                logger.warning("Assessment %s not found", assessment_id)
                 await manager.send(user_id, {"type": "error", "content": "Assessment not found"})
                 return
                 
-            assessment = json.loads(assessment_data)
-            topic = assessment["topic"]
-            print(f"Processing assessment for topic: {topic}")
-            
-            
-            evaluation_prompt = f"""Evaluate this assessment about "{topic}" and provide detailed feedback with pass/fail determination.
-
-Questions and Answers:
-"""
-            
-            questions_for_eval = []
-            for question in assessment["questions"]:
-                user_answer = user_answers.get(question["id"], "No answer provided")
-                questions_for_eval.append({
-                    "question": question["question"],
-                    "options": question["options"],
-                    "correct_answer": question["correct_answer"],
-                    "user_answer": user_answer,
-                    "explanation": question.get("explanation", "No explanation provided")
-                })
-                
-                evaluation_prompt += f"""\n\nQuestion: {question["question"]}
-Options: {', '.join(question["options"])}
-Correct Answer: {question["correct_answer"]}
-User Answer: {user_answer}
-"""
-            
-            evaluation_prompt += f"""\n\nProvide evaluation in this JSON format:
-{{
-  "overall_score": <percentage 0-100 EXACT calculation: correct_answers/total_questions*100>,
-  "pass_status": "<pass/retake/improve>",
-  "overall_feedback": "<comprehensive feedback about performance>",
-  "detailed_feedback": [
-    {{
-      "question": "<question text>",
-      "user_answer": "<user's answer>", 
-      "correct_answer": "<correct answer>",
-      "is_correct": <true/false - MUST be false if answers don't match exactly>,
-      "explanation": "<detailed explanation of why answer is right/wrong>",
-      "score": <points earned - 1 if correct, 0 if wrong>
-    }}
-}}
-
-Scoring criteria:
-- Below 50%: Recommend retaking the lesson with encouraging message
-- 50-79%: Provide specific areas for improvement and targeted suggestions  
-- 80% and above: Congratulate with enthusiastic message about mastery
-
-Be specific and educational in your feedback. Focus on helping the user learn."""
-
-            try:
-                
-                print(f"Calling OpenAI for evaluation with {len(questions_for_eval)} questions")
-                eval_response = await call_openai(evaluation_prompt)
-                print(f"OpenAI evaluation response received: {eval_response[:200]}...")
-                
-                eval_json = eval_response.strip()
-                if eval_json.startswith('```json'):
-                    eval_json = eval_json[7:-3].strip()
-                elif eval_json.startswith('```'):
-                    eval_json = eval_json[3:-3].strip()
-                
-                llm_result = json.loads(eval_json)
-                
-                # Calculate actual score from the evaluation
-                correct_count = sum(1 for item in llm_result.get("detailed_feedback", []) if item.get("is_correct", False))
-                total_questions = len(assessment["questions"])
-                final_score = round((correct_count / total_questions) * 100) if total_questions > 0 else 0
-                
-                if final_score >= 80:
-                    final_pass_status = "pass"
-                elif final_score >= 50:
-                    final_pass_status = "improve" 
-                else:
-                    final_pass_status = "retake"
-                
-                result = {
-                    "score": final_score,
-                    "pass_status": final_pass_status,
-                    "correct_answers": correct_count,
-                    "total_questions": total_questions,
-                    "feedback": llm_result.get("detailed_feedback", []),
-                    "overall_feedback": llm_result.get("overall_feedback", "Assessment completed."),
-                    "suggestions": llm_result.get("suggestions", ""),
-                    "strengths": llm_result.get("strengths", ""),
-                    "weakness_areas": llm_result.get("weakness_areas", ""),
-                    "congratulatory_message": llm_result.get("congratulatory_message", ""),
-                    "retake_message": llm_result.get("retake_message", ""),
-                    "improvement_message": llm_result.get("improvement_message", ""),
-                    "topic": topic
-                }
-                
-            except Exception as e:
-                print(f"LLM evaluation failed: {e}")
-
-            result["timestamp"] = int(time.time())
-            await rdb.setex(f"assessment_result:{user_id}:{assessment_id}", 3600, json.dumps(result))
+            assessment = codec.loads(assessment_data)
+            result = grade_assessment(assessment, user_answers)
+            if not await record_result(rdb, user_id, assessment_id, result):
+                # The first submission stands, so the stored result and the analytics agree.
+                stored = await rdb.get(f"assessment_result:{user_id}:{assessment_id}")
+                result = codec.loads(stored) if stored else result
             
             await manager.send(user_id, {"type": "assessment_result", "result": result})
+            if msg.get("feedback", True):
+                spawn(send_assessment_feedback(user_id, assessment_id, result, manager, rdb))
             
         except Exception as e:
-            print(f"Error processing assessment: {e}")
+            logger.exception("Error processing assessment %s: %s", assessment_id, e)
             await manager.send(user_id, {"type": "error", "content": "Failed to process assessment"})
     else:
         await manager.send(user_id, {"type": "error", "content": "Unsupported message type or missing data."})
 
-    await rdb.close()
-
 # WebSocket endpoint
 @app.websocket("/ws/tutor/{user_id}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str):
-    await manager.connect(websocket, user_id)
-    print(f"WebSocket connected for user: {user_id}")
+async def websocket_endpoint(websocket: WebSocket, user_id: str, rdb=Depends(get_redis)):
+    connection_id = await manager.connect(websocket, user_id)
+    if connection_id is None:
+        return
+    current_connection.set(connection_id)
+    logger.info("WebSocket connected for user %s (%s)", user_id, connection_id)
+
+    async def handle(message: dict):
+        # Opt-in tracing: a client-supplied trace_id, or "trace": true for a generated one,
+        # is echoed on every frame produced while handling the message.
+        trace_id = message.get("trace_id") or (uuid.uuid4().hex if message.get("trace") else None)
+        if trace_id:
+            current_trace.set(str(trace_id)[:64])
+        with WS_MESSAGE_SECONDS.time(message["type"] if message["type"] in MESSAGE_TYPES else "other"):
+            await handle_message(user_id, message, manager, rdb)
+
+    dispatcher = MessageDispatcher.from_env(user_id, handle)
+    dispatcher.start()
     try:
         while True:
             data = await websocket.receive_text()
-            print(f"Received raw data: {data}")
-            message = json.loads(data)
-            print(f"Parsed message: {message}")
-            await handle_message(user_id, message, manager)
+            manager.seen(user_id, connection_id)
+            try:
+                message = codec.decode_frame(data)
+            except ValueError:
+                WS_MESSAGES.inc("invalid")
+                await manager.send(user_id, {"type": "error", "content": "Invalid message format."})
+                continue
+            if not isinstance(message, dict) or "type" not in message:
+                WS_MESSAGES.inc("invalid")
+                await manager.send(user_id, {"type": "error", "content": "Unsupported message type or missing data."})
+                continue
+            if message["type"] == "pong":
+                continue
+            if message["type"] == "ping":
+                await manager.send(user_id, {"type": "pong", "ts": message.get("ts")})
+                continue
+            WS_MESSAGES.inc(message["type"] if message["type"] in MESSAGE_TYPES else "other")
+            if not dispatcher.submit(message):
+                await manager.send(user_id, {"type": "error", "content": "Too many pending messages, please wait."})
     except WebSocketDisconnect:
-        print(f"WebSocket disconnected for user: {user_id}")
-        manager.disconnect(user_id)
+        logger.info("WebSocket disconnected for user %s (%s)", user_id, connection_id)
+    except Exception as e:
+        logger.error("WebSocket error for user %s: %s", user_id, e)
+    finally:
+        await dispatcher.close()
+        await manager.disconnect(user_id, connection_id)
 
 @app.delete("/api/lesson_context/{user_id}/{topic}")
-async def clear_lesson_context(user_id: str, topic: str):
-    rdb = redis.from_url(REDIS_URL, decode_responses=True)
+async def clear_lesson_context(user_id: str, topic: str, rdb=Depends(get_redis)):
     try:
-        topic_key = topic.replace(' ', '_').lower()
-        await rdb.delete(f"lesson_context:{user_id}:{topic_key}")
-        await rdb.delete(f"assessment:{user_id}:{topic_key}")
+        key = topic_key(topic)
+        await rdb.delete(f"lesson_context:{user_id}:{key}")
+        await rdb.delete(f"assessment:{user_id}:{key}")
+        # The rolling chat context is per user, so it is dropped along with any topic's context.
+        await chat_context.clear(rdb, user_id)
         return {"message": "Context cleared successfully"}
     except Exception as e:
         return {"error": "Failed to clear context"}
-    finally:
-        await rdb.close()
 
 @app.get("/api/conversations/{user_id}")
-async def get_conversations(user_id: str):
-    rdb = redis.from_url(REDIS_URL, decode_responses=True)
+async def get_conversations(user_id: str, limit: int = 20, cursor: Optional[str] = None,
+                            include_history: bool = True, rdb=Depends(get_redis)):
     try:
-        user_conversations = await rdb.get(f"user_conversations:{user_id}")
-        if user_conversations:
-            conversations = json.loads(user_conversations)
-            
-            for conv in conversations:
-                chat_history = await rdb.get(f"chat_history:{user_id}:{conv['topic']}")
-                if chat_history:
-                    conv['chat_history'] = json.loads(chat_history)
-                else:
-                    conv['chat_history'] = []
-            return {"conversations": conversations}
-        return {"conversations": []}
+        return await list_conversations(rdb, user_id, limit=limit, cursor=cursor, include_history=include_history)
     except Exception as e:
-        return {"conversations": []}
-    finally:
-        await rdb.close()
+        return {"conversations": [], "next_cursor": None}
+
+@app.get("/api/conversations/{user_id}/{conversation_id}/history")
+async def get_conversation(user_id: str, conversation_id: str, rdb=Depends(get_redis)):
+    chat_history = await get_conversation_history(rdb, user_id, conversation_id)
+    if chat_history is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"id": conversation_id, "chat_history": chat_history}
 
 
 @app.get("/api/analytics/{user_id}")
-async def get_analytics(user_id: str):
-    rdb = redis.from_url(REDIS_URL, decode_responses=True)
-    try:
-        print(f"Getting analytics for user_id: {user_id}")
-        
-        
-        user_conversations = await rdb.get(f"user_conversations:{user_id}")
-        conversations = json.loads(user_conversations) if user_conversations else []
-        print(f"Found {len(conversations)} conversations")
-        
-        assessment_keys = await rdb.keys(f"assessment_result:{user_id}:*")
-        assessment_results = []
-        print(f"Found {len(assessment_keys)} assessment keys for user {user_id}")
-        
-        for key in assessment_keys:
-            result_data = await rdb.get(key)
-            if result_data:
-                assessment_results.append(json.loads(result_data))
-       
-        total_lessons = len(conversations)
-        assessments_taken = len(assessment_results)
-        print(f"Analytics: {total_lessons} lessons, {assessments_taken} assessments")
-        
-        if assessment_results:
-            total_score = sum(result.get('score', 0) for result in assessment_results)
-            average_score = round(total_score / assessments_taken, 1)
-        else:
-            average_score = 0
-        
-        topics_studied = list(set(conv.get('topic', 'Unknown') for conv in conversations))
-        
-        recent_assessments = sorted(
-            assessment_results, 
-            key=lambda x: x.get('timestamp', 0), 
-            reverse=True
-        )[:5]
-        
-        return {
-            "total_lessons": total_lessons,
-            "assessments_taken": assessments_taken,
-            "average_score": average_score,
-            "topics_studied": topics_studied,
-            "recent_assessments": recent_assessments,
-            "pass_rate": round(
-                len([r for r in assessment_results if r.get('score', 0) >= 60]) / max(assessments_taken, 1) * 100, 1
-            ) if assessments_taken > 0 else 0
-        }
-    finally:
-        await rdb.close()
+async def get_analytics(user_id: str, rdb=Depends(get_redis)):
+    return await read_analytics(rdb, user_id)
+
+@app.get("/api/admin/cache/lessons", dependencies=[Depends(require_admin)])
+async def lesson_cache_stats():
+    return lesson_cache.snapshot()
+
+@app.delete("/api/admin/cache/lessons", dependencies=[Depends(require_admin)])
+async def invalidate_lesson_cache(topic: Optional[str] = None, rdb=Depends(get_redis)):
+    removed = await lesson_cache.invalidate(rdb, topic)
+    return {"removed": removed, "topic": topic}
+
+@app.get("/api/admin/llm", dependencies=[Depends(require_admin)])
+async def llm_scheduler_stats():
+    return llm_scheduler.snapshot()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    for name, depth in llm_scheduler.queue_depth().items():
+        LLM_QUEUE_DEPTH.set(depth, name)
+    LLM_CIRCUIT_OPEN.set(1 if llm_scheduler.degraded else 0)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
@@ -525,4 +565,6 @@ async def register(user_data: UserCreate):
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    reload = os.getenv("UVICORN_RELOAD", "false").lower() == "true" and workers == 1
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=reload, workers=workers)
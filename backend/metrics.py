@@ -0,0 +1,150 @@
+import time
+import bisect
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.values: Dict[Tuple, object] = {}
+        REGISTRY.register(self)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name}_total {self.documentation}", f"# TYPE {self.name}_total {self.kind}"]
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}_total{_labels(self.label_names, key)} {_number(value)}"
+                for key, value in self.values.items()]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in self.values.items()]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        # Per-bucket counts plus [sum, count]; cumulated only when rendered.
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    """Process-local metrics; each worker exposes its own series and Prometheus sums them."""
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric):
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+WS_MESSAGES = Counter("tutor_ws_messages", "WebSocket messages received, by type.", ["type"])
+WS_MESSAGE_SECONDS = Histogram("tutor_ws_message_seconds", "Time spent handling a WebSocket message.", ["type"])
+WS_CONNECTIONS = Gauge("tutor_ws_active_connections", "WebSocket connections open on this worker.")
+WS_REJECTED = Counter("tutor_ws_rejected_connections", "WebSocket connections refused at the connection cap.")
+WS_QUEUED_BYTES = Gauge("tutor_ws_outbound_queued_bytes", "Encoded frames waiting in per-connection outboxes.")
+WS_FRAMES_DROPPED = Counter("tutor_ws_frames_dropped", "Outbound frames dropped because an outbox was full.", ["reason"])
+WS_EVICTIONS = Counter("tutor_ws_evictions", "Connections closed by the server, by reason.", ["reason"])
+REDIS_SECONDS = Histogram("tutor_redis_command_seconds", "Redis round-trip latency, by command.", ["command"])
+LLM_QUEUE_WAIT_SECONDS = Histogram("tutor_llm_queue_wait_seconds", "Time LLM calls wait in the scheduler queue.",
+                                   ["priority"])
+LLM_QUEUE_DEPTH = Gauge("tutor_llm_queue_depth", "LLM calls waiting in the scheduler queue.", ["priority"])
+LLM_FIRST_TOKEN_SECONDS = Histogram("tutor_llm_time_to_first_token_seconds",
+                                    "Time from dispatching a streamed LLM call to its first delta.", ["priority"])
+LLM_GENERATION_SECONDS = Histogram("tutor_llm_generation_seconds", "Total LLM generation time once dispatched.",
+                                   ["priority", "mode"])
+LLM_HEDGES = Counter("tutor_llm_hedges", "Hedged LLM attempts, by outcome: fired, won or skipped for lack of capacity.",
+                     ["priority", "outcome"])
+LLM_CIRCUIT_OPEN = Gauge("tutor_llm_circuit_open", "1 while the LLM circuit breaker is failing calls fast.")
+LLM_ERRORS = Counter("tutor_llm_errors", "Failed LLM attempts, by HTTP status or error kind.", ["status"])
+LLM_PARSE_SECONDS = Histogram("tutor_llm_parse_seconds", "Time spent parsing and repairing LLM JSON output.",
+                              ["kind", "outcome"])
+
+
+def render() -> str:
+    return REGISTRY.render()
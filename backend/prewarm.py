@@ -0,0 +1,261 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, List, Optional
+
+from llm_client import LLMError
+from llm_scheduler import PRIORITY_ASSESSMENT, PRIORITY_LESSON, LLMScheduler
+from log import get_logger
+from tokens import count_tokens
+from topics import extract_topic, request_key
+from main import (QUESTION_BANK_BATCH, build_assessment_prompt, build_lesson_prompt, lesson_cache,
+                  llm_client, question_bank, redis_provider)
+
+logger = get_logger("prewarm")
+
+
+def read_topics(path: str) -> List[str]:
+    """Topics in file order, without comments, blanks or entries that share a cache key."""
+    with (sys.stdin if path == "-" else open(path)) as f:
+        lines = [line.split("#", 1)[0].strip() for line in f]
+    seen, topics = set(), []
+    for topic in lines:
+        if topic and request_key(topic) not in seen:
+            seen.add(request_key(topic))
+            topics.append(topic)
+    return topics
+
+
+class Usage:
+    """Estimated token usage and cost; the client does not surface provider usage, so counts are local."""
+
+    def __init__(self, price_input: float, price_output: float):
+        self.price_input = price_input
+        self.price_output = price_output
+        self.calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def add(self, calls: int, input_tokens: int, output_tokens: int):
+        self.calls += calls
+        self.input_tokens += input_tokens
+        self.output_tokens += output_tokens
+
+    @property
+    def cost(self) -> float:
+        return (self.input_tokens * self.price_input + self.output_tokens * self.price_output) / 1000
+
+    def snapshot(self) -> dict:
+        return {"calls": self.calls, "input_tokens": self.input_tokens, "output_tokens": self.output_tokens,
+                "cost": round(self.cost, 4)}
+
+
+class Prewarmer:
+    def __init__(self, rdb, scheduler: LLMScheduler, usage: Usage, min_ttl: int, state_path: Optional[str],
+                 lessons: bool = True, questions: bool = True):
+        self.rdb = rdb
+        self.scheduler = scheduler
+        self.usage = usage
+        self.min_ttl = min_ttl
+        self.state_path = state_path
+        self.lessons = lessons
+        self.questions = questions
+        self.state: Dict[str, dict] = {}
+        self.counts = {"done": 0, "skipped": 0, "partial": 0, "failed": 0}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    async def fresh(self, key: str) -> bool:
+        return await self.rdb.ttl(key) >= self.min_ttl
+
+    async def complete(self, prompt: str, priority: int, entry: dict) -> str:
+        content = await self.scheduler.complete(prompt, priority=priority)
+        entry["calls"] = entry.get("calls", 0) + 1
+        entry["input_tokens"] = entry.get("input_tokens", 0) + count_tokens(prompt)
+        entry["output_tokens"] = entry.get("output_tokens", 0) + count_tokens(content)
+        return content
+
+    async def warm_lesson(self, topic: str, entry: dict) -> str:
+        if await self.fresh(lesson_cache.key(topic)):
+            return "fresh"
+        content = await self.complete(build_lesson_prompt(topic), PRIORITY_LESSON, entry)
+        if not lesson_cache.cacheable(content):
+            raise LLMError("Empty lesson")
+        await lesson_cache.set(self.rdb, topic, content)
+        return "generated"
+
+    async def warm_questions(self, topic: str, entry: dict) -> str:
+        key = question_bank.key(topic)
+        size = await question_bank.size(self.rdb, topic)
+        if size >= question_bank.target_size and await self.fresh(key):
+            return "fresh"
+        if size and not await self.fresh(key):
+            # Replace a stale bank; live workers wait on the fill lock instead of generating alongside us.
+            await self.rdb.delete(key)
+        prompt = build_assessment_prompt(topic)
+
+        async def generate(on_delta) -> str:
+            return await self.complete(prompt, PRIORITY_ASSESSMENT, entry)
+
+        # Each fill adds one batch; stop early if a batch adds nothing rather than spend on a topic that fails.
+        for _ in range(-(-question_bank.target_size // QUESTION_BANK_BATCH) + 1):
+            if await question_bank.size(self.rdb, topic) >= question_bank.target_size:
+                break
+            if not await question_bank.ensure(self.rdb, topic, generate):
+                break
+        size = await question_bank.size(self.rdb, topic)
+        if size >= question_bank.target_size:
+            return "generated"
+        return "partial" if size else "failed"
+
+    async def warm(self, topic: str) -> dict:
+        entry = {"topic": topic}
+        started = time.perf_counter()
+        if self.lessons:
+            try:
+                entry["lesson"] = await self.warm_lesson(topic, entry)
+            except LLMError as e:
+                logger.warning("Lesson for '%s' failed: %s", topic, e)
+                entry["lesson"], entry["error"] = "failed", str(e)
+        if self.questions:
+            entry["questions"] = await self.warm_questions(extract_topic(topic), entry)
+        entry["seconds"] = round(time.perf_counter() - started, 3)
+        return entry
+
+    async def run(self, topics: List[str], concurrency: int, progress=None) -> dict:
+        semaphore = asyncio.Semaphore(concurrency)
+        finished = 0
+
+        async def one(topic: str):
+            nonlocal finished
+            async with semaphore:
+                entry = await self.warm(topic)
+            results = [entry.get("lesson"), entry.get("questions")]
+            status = ("failed" if "failed" in results else "partial" if "partial" in results
+                      else "skipped" if all(result in ("fresh", None) for result in results) else "done")
+            entry["status"] = status
+            self.counts[status] += 1
+            spent = [entry.get(field, 0) for field in ("calls", "input_tokens", "output_tokens")]
+            self.usage.add(*spent)
+            # Earlier runs' spend on this topic stays in the checkpoint so resumed totals add up.
+            previous = self.state.get(request_key(topic), {})
+            for field, amount in zip(("calls", "input_tokens", "output_tokens"), spent):
+                entry[f"total_{field}"] = previous.get(f"total_{field}", 0) + amount
+            self.state[request_key(topic)] = entry
+            self.save_state()
+            finished += 1
+            if progress:
+                progress(finished, len(topics), entry)
+
+        await asyncio.gather(*(one(topic) for topic in topics))
+        return self.report(len(topics))
+
+    def total_usage(self) -> dict:
+        """Spend recorded in the checkpoint across every run, resumed ones included."""
+        usage = Usage(self.usage.price_input, self.usage.price_output)
+        for entry in self.state.values():
+            usage.add(entry.get("total_calls", 0), entry.get("total_input_tokens", 0), entry.get("total_output_tokens", 0))
+        return usage.snapshot()
+
+    def report(self, total: int) -> dict:
+        return {
+            "topics": total,
+            **self.counts,
+            "failed_topics": sorted(entry["topic"] for entry in self.state.values() if entry.get("status") == "failed"),
+            "usage": self.usage.snapshot(),
+            "total_usage": self.total_usage(),
+            "scheduler": self.scheduler.snapshot(),
+        }
+
+
+def estimate(topics: List[str], usage: Usage, lessons: bool, questions: bool) -> dict:
+    """Upper-bound cost if every topic is generated, from prompt size plus each call's max_tokens."""
+    calls = []
+    for topic in topics:
+        if lessons:
+            calls.append(build_lesson_prompt(topic))
+        if questions:
+            batches = -(-question_bank.target_size // QUESTION_BANK_BATCH)
+            calls.extend([build_assessment_prompt(extract_topic(topic))] * batches)
+    usage.add(len(calls), sum(count_tokens(prompt) for prompt in calls), 2000 * len(calls))
+    return {"topics": len(topics), "estimate": usage.snapshot()}
+
+
+def print_progress(finished: int, total: int, entry: dict):
+    parts = [f"{name} {entry[name]}" for name in ("lesson", "questions") if name in entry]
+    print(f"[{finished}/{total}] {entry['topic']}: {', '.join(parts)} ({entry['seconds']}s)", flush=True)
+
+
+async def prewarm(args) -> dict:
+    usage = Usage(args.price_input, args.price_output)
+    topics = read_topics(args.topics)
+    if args.dry_run:
+        return estimate(topics, usage, not args.skip_lessons, not args.skip_questions)
+
+    await redis_provider.startup()
+    if redis_provider.mode != "connected" and not args.allow_memory:
+        await redis_provider.shutdown()
+        raise SystemExit("Redis is unreachable; refusing to pre-warm the in-process fallback (use --allow-memory)")
+    await llm_client.startup()
+    scheduler = LLMScheduler.from_env(llm_client)
+    # A batch job waits its turn under the rate limits instead of being shed, and never hedges.
+    scheduler.deadlines = {priority: args.queue_timeout for priority in scheduler.deadlines}
+    scheduler.hedged = set()
+    try:
+        # Without --allow-memory a Redis outage mid-run fails the run instead of warming the fallback store.
+        rdb = redis_provider.client if args.allow_memory else redis_provider.redis
+        prewarmer = Prewarmer(rdb, scheduler, usage, args.min_ttl, args.state,
+                              lessons=not args.skip_lessons, questions=not args.skip_questions)
+        return await prewarmer.run(topics, args.concurrency, progress=None if args.quiet else print_progress)
+    finally:
+        await llm_client.shutdown()
+        await redis_provider.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate lessons and question banks for a topic list")
+    parser.add_argument("topics", help="file with one topic per line, or - for stdin")
+    parser.add_argument("--concurrency", type=int, default=4, help="topics warmed at once")
+    parser.add_argument("--min-ttl", type=int, default=lesson_cache.ttl // 2,
+                        help="seconds of TTL an entry needs left to count as fresh")
+    parser.add_argument("--state", default="prewarm_state.json", help="checkpoint file; empty to disable")
+    parser.add_argument("--report", help="write the final report here as JSON")
+    parser.add_argument("--skip-lessons", action="store_true")
+    parser.add_argument("--skip-questions", action="store_true")
+    parser.add_argument("--queue-timeout", type=float, default=3600.0,
+                        help="seconds a call may wait for rate-limit budget")
+    parser.add_argument("--price-input", type=float, default=float(os.getenv("LLM_PRICE_INPUT", "0.0005")),
+                        help="cost per 1K prompt tokens")
+    parser.add_argument("--price-output", type=float, default=float(os.getenv("LLM_PRICE_OUTPUT", "0.0015")),
+                        help="cost per 1K completion tokens")
+    parser.add_argument("--dry-run", action="store_true", help="only estimate the worst-case cost")
+    parser.add_argument("--allow-memory", action="store_true", help="run even if Redis falls back to memory")
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    report = asyncio.run(prewarm(args))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    usage = report.get("usage") or report["estimate"]
+    counts = "".join(f", {name} {report[name]}" for name in ("done", "skipped", "partial", "failed") if name in report)
+    print(f"{report['topics']} topics{counts}; {usage['calls']} LLM calls, ~{usage['input_tokens']} prompt and "
+          f"~{usage['output_tokens']} completion tokens, ~${usage['cost']:.4f}")
+    if report.get("failed"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import os
+import time
+import uuid
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError, field_validator, model_validator
+
+import codec
+from llm_json import ItemStream, JsonExtractionError, extract_json
+from log import get_logger
+from metrics import LLM_PARSE_SECONDS
+from topics import cache_topic_key
+
+logger = get_logger(__name__)
+
+
+# Called with an on_delta callback; returns the full response text.
+Generate = Callable[[Callable[[str], Awaitable[None]]], Awaitable[str]]
+
+
+class InvalidAssessment(ValueError):
+    pass
+
+
+class GeneratedQuestion(BaseModel):
+    question: str
+    options: List[str]
+    correct_answer: str
+    explanation: Optional[str] = None
+
+    @field_validator("question")
+    @classmethod
+    def question_text(cls, value: str) -> str:
+        if not value.strip():
+            raise ValueError("empty question")
+        return value.strip()
+
+    @field_validator("options")
+    @classmethod
+    def enough_options(cls, value: List[str]) -> List[str]:
+        if len(value) < 2:
+            raise ValueError("fewer than two options")
+        return value
+
+    @field_validator("explanation", mode="before")
+    @classmethod
+    def optional_explanation(cls, value: Any) -> Optional[str]:
+        return value if isinstance(value, str) else None
+
+    @model_validator(mode="after")
+    def answer_is_an_option(self) -> "GeneratedQuestion":
+        if self.correct_answer not in self.options:
+            raise ValueError("correct_answer is not one of the options")
+        return self
+
+
+class GeneratedAssessment(BaseModel):
+    questions: List[Any]
+
+
+def validate_question(item: Any) -> Optional[dict]:
+    """The bank entry for one generated question, or None if it is unusable."""
+    try:
+        return GeneratedQuestion.model_validate(item).model_dump(exclude_none=True)
+    except ValidationError:
+        return None
+
+
+def parse_questions(response: str) -> Tuple[List[dict], Tuple[str, ...]]:
+    """Valid questions in a model response, plus the repairs needed to read it; invalid questions are dropped."""
+    try:
+        extracted = extract_json(response)
+        data = GeneratedAssessment.model_validate(extracted.value)
+    except JsonExtractionError as e:
+        raise InvalidAssessment(f"Assessment response is not JSON: {e}")
+    except ValidationError:
+        raise InvalidAssessment("Assessment response has no questions list")
+
+    questions = [question for question in map(validate_question, data.questions) if question]
+    if not questions:
+        raise InvalidAssessment("Assessment response has no valid questions")
+    return questions, extracted.repairs
+
+
+class QuestionBank:
+    """Per-topic pool of validated questions in Redis, topped up in the background."""
+
+    def __init__(self, target_size: int = 12, ttl: int = 7 * 86400, lock_ttl: int = 120):
+        self.target_size = target_size
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self._generating: Dict[str, asyncio.Task] = {}
+        self._background = set()
+        self._progress: Dict[str, asyncio.Event] = {}
+        self.stats = {"generated": 0, "rejected": 0, "repaired": 0, "samples": 0, "short_samples": 0}
+
+    @classmethod
+    def from_env(cls) -> "QuestionBank":
+        return cls(
+            target_size=int(os.getenv("QUESTION_BANK_TARGET", "12")),
+            ttl=int(os.getenv("QUESTION_BANK_TTL", str(7 * 86400))),
+        )
+
+    @staticmethod
+    def key(topic: str) -> str:
+        return f"question_bank:{cache_topic_key(topic)}"
+
+    async def size(self, rdb, topic: str) -> int:
+        return await rdb.scard(self.key(topic))
+
+    def _notify(self, key: str):
+        event = self._progress.pop(key, None)
+        if event is not None:
+            event.set()
+
+    async def _add(self, rdb, key: str, questions: List[dict]) -> int:
+        added = await rdb.sadd(key, *[codec.dumps(q, sort_keys=True) for q in questions])
+        await rdb.expire(key, self.ttl)
+        self.stats["generated"] += added
+        self._notify(key)
+        return added
+
+    async def _fill(self, rdb, topic: str, generate: Generate) -> int:
+        key = self.key(topic)
+        lock_key = f"{key}:lock"
+        if not await rdb.set(lock_key, "1", ex=self.lock_ttl, nx=True):
+            # Another worker is filling this bank; wait for it rather than generating twice.
+            while await rdb.exists(lock_key) and not await rdb.scard(key):
+                await asyncio.sleep(0.25)
+            return 0
+        try:
+            if await rdb.scard(key) >= self.target_size:
+                return 0
+            # Questions are banked as they stream in, so a waiting assessment can go out before the batch ends.
+            stream = ItemStream()
+            added = 0
+
+            async def on_delta(delta: str):
+                nonlocal added
+                questions = [question for question in map(validate_question, stream.feed(delta)) if question]
+                if questions:
+                    added += await self._add(rdb, key, questions)
+
+            response = await generate(on_delta)
+            started = time.perf_counter()
+            try:
+                questions, repairs = parse_questions(response)
+            except InvalidAssessment as e:
+                LLM_PARSE_SECONDS.observe(time.perf_counter() - started, "questions", "rejected")
+                self.stats["rejected"] += 1
+                logger.warning("Rejected generated assessment for '%s': %s", topic, e)
+                return added
+            LLM_PARSE_SECONDS.observe(time.perf_counter() - started, "questions", "repaired" if repairs else "ok")
+            if repairs:
+                self.stats["repaired"] += 1
+                logger.info("Repaired generated assessment for '%s': %s", topic, ", ".join(repairs))
+            added += await self._add(rdb, key, questions)
+            logger.info("Question bank '%s': added %d questions", topic, added)
+            return added
+        finally:
+            await rdb.delete(lock_key)
+
+    async def ensure(self, rdb, topic: str, generate: Generate) -> int:
+        """Top the bank up if it is below target; concurrent callers share one generation."""
+        key = self.key(topic)
+        task = self._generating.get(key)
+        if task is None:
+            if await rdb.scard(key) >= self.target_size:
+                return 0
+            task = asyncio.create_task(self._fill(rdb, topic, generate))
+            self._generating[key] = task
+            task.add_done_callback(lambda t: self._generating.pop(key, None))
+        try:
+            return await asyncio.shield(task)
+        except Exception as e:
+            logger.error("Question bank generation failed for '%s': %s", topic, e)
+            return 0
+        finally:
+            self._notify(key)
+
+    async def wait_for_questions(self, rdb, topic: str, fill: asyncio.Task, count: int = 3):
+        """Return once the bank holds `count` questions or the fill task has finished."""
+        key = self.key(topic)
+        while not fill.done() and await rdb.scard(key) < count:
+            event = self._progress.setdefault(key, asyncio.Event())
+            try:
+                # The timeout also covers a fill running on another worker, which cannot signal us.
+                await asyncio.wait_for(event.wait(), timeout=0.25)
+            except asyncio.TimeoutError:
+                pass
+
+    def prefetch(self, rdb, topic: str, generate: Generate) -> asyncio.Task:
+        task = asyncio.create_task(self.ensure(rdb, topic, generate))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    async def sample(self, rdb, topic: str, count: int = 3) -> Optional[dict]:
+        members = await rdb.srandmember(self.key(topic), count)
+        self.stats["samples"] += 1
+        if len(members) < count:
+            self.stats["short_samples"] += 1
+        if not members:
+            return None
+        questions = []
+        for index, member in enumerate(members, start=1):
+            question = codec.loads(member)
+            question["id"] = f"q{index}"
+            questions.append(question)
+        return {
+            "id": str(uuid.uuid4()),
+            "topic": topic,
+            "questions": questions,
+        }
@@ -0,0 +1,471 @@
+import os
+import time
+import random
+import asyncio
+import fnmatch
+import inspect
+import redis.asyncio as redis
+from redis.asyncio.client import Pipeline
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from typing import Dict, Optional
+
+from log import get_logger
+from metrics import REDIS_SECONDS
+
+logger = get_logger(__name__)
+
+# Errors that mean Redis itself is unreachable, as opposed to a bad command.
+FAILOVER_ERRORS = (RedisConnectionError, RedisTimeoutError)
+
+
+class RedisSettings:
+    def __init__(self, max_connections: int = 50, pool_timeout: float = 5.0,
+                 socket_timeout: float = 5.0, connect_timeout: float = 2.0,
+                 health_check_interval: int = 30, probe_interval: float = 5.0):
+        self.max_connections = max_connections
+        self.pool_timeout = pool_timeout
+        self.socket_timeout = socket_timeout
+        self.connect_timeout = connect_timeout
+        self.health_check_interval = health_check_interval
+        self.probe_interval = probe_interval
+
+    @classmethod
+    def from_env(cls) -> "RedisSettings":
+        return cls(
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "50")),
+            pool_timeout=float(os.getenv("REDIS_POOL_TIMEOUT", "5")),
+            socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT", "5")),
+            connect_timeout=float(os.getenv("REDIS_CONNECT_TIMEOUT", "2")),
+            health_check_interval=int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+            probe_interval=float(os.getenv("REDIS_PROBE_INTERVAL", "5")),
+        )
+
+
+class MemoryRedis:
+    """In-process stand-in for the subset of the redis.asyncio API the app uses."""
+
+    def __init__(self):
+        self._data: Dict[str, object] = {}
+        self._expires: Dict[str, float] = {}
+
+    def _alive(self, key: str) -> bool:
+        expires_at = self._expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return key in self._data
+
+    @staticmethod
+    def _encode(value) -> str:
+        if isinstance(value, bytes):
+            return value.decode()
+        return str(value)
+
+    async def ping(self) -> bool:
+        return True
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._data[key] if self._alive(key) else None
+
+    async def mget(self, keys, *args):
+        keys = list(keys) if isinstance(keys, (list, tuple)) else [keys, *args]
+        return [await self.get(key) for key in keys]
+
+    async def set(self, key: str, value, ex: Optional[int] = None, nx: bool = False):
+        if nx and self._alive(key):
+            return None
+        self._data[key] = self._encode(value)
+        self._expires.pop(key, None)
+        if ex is not None:
+            self._expires[key] = time.monotonic() + ex
+        return True
+
+    async def setex(self, key: str, seconds: int, value):
+        return await self.set(key, value, ex=seconds)
+
+    async def delete(self, *keys: str) -> int:
+        removed = 0
+        for key in keys:
+            if self._alive(key):
+                removed += 1
+            self._data.pop(key, None)
+            self._expires.pop(key, None)
+        return removed
+
+    async def exists(self, *keys: str) -> int:
+        return sum(1 for key in keys if self._alive(key))
+
+    async def expire(self, key: str, seconds: int) -> bool:
+        if not self._alive(key):
+            return False
+        self._expires[key] = time.monotonic() + seconds
+        return True
+
+    async def ttl(self, key: str) -> int:
+        if not self._alive(key):
+            return -2
+        expires_at = self._expires.get(key)
+        return -1 if expires_at is None else max(int(expires_at - time.monotonic()), 0)
+
+    def _set(self, key: str, create: bool = False):
+        if self._alive(key):
+            return self._data[key]
+        if create:
+            self._data[key] = set()
+            return self._data[key]
+        return set()
+
+    async def sadd(self, key: str, *members) -> int:
+        members_set = self._set(key, create=True)
+        before = len(members_set)
+        members_set.update(self._encode(member) for member in members)
+        return len(members_set) - before
+
+    async def srem(self, key: str, *members) -> int:
+        members_set = self._set(key)
+        removed = 0
+        for member in members:
+            member = self._encode(member)
+            if member in members_set:
+                members_set.discard(member)
+                removed += 1
+        return removed
+
+    async def scard(self, key: str) -> int:
+        return len(self._set(key))
+
+    async def smembers(self, key: str) -> set:
+        return set(self._set(key))
+
+    async def srandmember(self, key: str, number: Optional[int] = None):
+        members = list(self._set(key))
+        if number is None:
+            return random.choice(members) if members else None
+        return random.sample(members, min(number, len(members)))
+
+    def _hash(self, key: str, create: bool = False) -> dict:
+        if self._alive(key):
+            return self._data[key]
+        if create:
+            self._data[key] = {}
+            return self._data[key]
+        return {}
+
+    async def hset(self, key: str, field=None, value=None, mapping: Optional[dict] = None) -> int:
+        fields = self._hash(key, create=True)
+        items = dict(mapping or {})
+        if field is not None:
+            items[field] = value
+        added = sum(1 for name in items if self._encode(name) not in fields)
+        fields.update({self._encode(name): self._encode(val) for name, val in items.items()})
+        return added
+
+    async def hget(self, key: str, field) -> Optional[str]:
+        return self._hash(key).get(self._encode(field))
+
+    async def hgetall(self, key: str) -> dict:
+        return dict(self._hash(key))
+
+    async def hincrby(self, key: str, field, amount: int = 1) -> int:
+        fields = self._hash(key, create=True)
+        value = int(fields.get(self._encode(field), 0)) + int(amount)
+        fields[self._encode(field)] = str(value)
+        return value
+
+    def _zset(self, key: str, create: bool = False) -> dict:
+        return self._hash(key, create)
+
+    def _zsorted(self, key: str) -> list:
+        return sorted(self._zset(key).items(), key=lambda item: (item[1], item[0]))
+
+    async def zadd(self, key: str, mapping: dict) -> int:
+        members = self._zset(key, create=True)
+        added = sum(1 for member in mapping if self._encode(member) not in members)
+        members.update({self._encode(member): float(score) for member, score in mapping.items()})
+        return added
+
+    async def zcard(self, key: str) -> int:
+        return len(self._zset(key))
+
+    async def zrange(self, key: str, start: int, end: int, withscores: bool = False):
+        items = self._zsorted(key)
+        end = len(items) if end == -1 else end + 1
+        items = items[start:end]
+        return items if withscores else [member for member, _ in items]
+
+    async def zrevrange(self, key: str, start: int, end: int, withscores: bool = False):
+        items = self._zsorted(key)[::-1]
+        end = len(items) if end == -1 else end + 1
+        items = items[start:end]
+        return items if withscores else [member for member, _ in items]
+
+    async def zrevrank(self, key: str, member) -> Optional[int]:
+        members = await self.zrevrange(key, 0, -1)
+        member = self._encode(member)
+        return members.index(member) if member in members else None
+
+    async def zcount(self, key: str, min_score, max_score) -> int:
+        low, high = float(min_score), float(max_score)
+        return sum(1 for score in self._zset(key).values() if low <= score <= high)
+
+    async def zremrangebyscore(self, key: str, min_score, max_score) -> int:
+        low, high = float(min_score), float(max_score)
+        members = [member for member, score in self._zset(key).items() if low <= score <= high]
+        return await self.zrem(key, *members) if members else 0
+
+    async def zrem(self, key: str, *members) -> int:
+        zset = self._zset(key)
+        return sum(1 for member in members if zset.pop(self._encode(member), None) is not None)
+
+    async def zremrangebyrank(self, key: str, start: int, end: int) -> int:
+        members = await self.zrange(key, start, end)
+        return await self.zrem(key, *members) if members else 0
+
+    def _list(self, key: str, create: bool = False) -> list:
+        if self._alive(key):
+            return self._data[key]
+        if create:
+            self._data[key] = []
+            return self._data[key]
+        return []
+
+    @staticmethod
+    def _bounds(length: int, start: int, end: int) -> slice:
+        start = max(length + start, 0) if start < 0 else start
+        end = length + end if end < 0 else end
+        return slice(start, max(end + 1, start))
+
+    async def rpush(self, key: str, *values) -> int:
+        items = self._list(key, create=True)
+        items.extend(self._encode(value) for value in values)
+        return len(items)
+
+    async def lpush(self, key: str, *values) -> int:
+        items = self._list(key, create=True)
+        items[:0] = [self._encode(value) for value in reversed(values)]
+        return len(items)
+
+    async def llen(self, key: str) -> int:
+        return len(self._list(key))
+
+    async def lrange(self, key: str, start: int, end: int) -> list:
+        items = self._list(key)
+        return items[self._bounds(len(items), start, end)]
+
+    async def ltrim(self, key: str, start: int, end: int) -> bool:
+        items = self._list(key)
+        if items:
+            items[:] = items[self._bounds(len(items), start, end)]
+            if not items:
+                await self.delete(key)
+        return True
+
+    def pipeline(self, transaction: bool = True) -> "MemoryPipeline":
+        return MemoryPipeline(self)
+
+    async def keys(self, pattern: str = "*"):
+        return [key for key in list(self._data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    async def scan_iter(self, match: Optional[str] = None, count: Optional[int] = None):
+        for key in await self.keys(match or "*"):
+            yield key
+
+    async def aclose(self):
+        pass
+
+    close = aclose
+
+
+class MemoryPipeline:
+    """Queues commands and runs them back to back; the event loop makes that atomic in-process."""
+
+    def __init__(self, store: MemoryRedis):
+        self._store = store
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._store, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self) -> list:
+        commands, self._commands = self._commands, []
+        return [await method(*args, **kwargs) for method, args, kwargs in commands]
+
+    async def __aenter__(self) -> "MemoryPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._commands = []
+
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            REDIS_SECONDS.observe(time.perf_counter() - started, "PIPELINE")
+
+
+class InstrumentedRedis(redis.Redis):
+    """redis.Redis that records each round trip in the tutor_redis_command_seconds histogram."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_SECONDS.observe(time.perf_counter() - started, str(args[0]).upper())
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+class FailoverRedis:
+    """Stable client handle: every command goes to the provider's current store and retries on the fallback
+    if Redis turns out to be unreachable, so handlers never hold on to a dead connection."""
+
+    def __init__(self, provider: "RedisProvider"):
+        self._provider = provider
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._provider.active, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            store = self._provider.active
+            result = getattr(store, name)(*args, **kwargs)
+            # Async iterators such as scan_iter are not retried; they stay on the store they started on.
+            if not inspect.isawaitable(result):
+                return result
+            return self._failover(store, result, name, args, kwargs)
+        return call
+
+    async def _failover(self, store, result, name: str, args, kwargs):
+        try:
+            return await result
+        except FAILOVER_ERRORS as e:
+            if store is not self._provider.redis:
+                raise
+            self._provider.fail(e)
+            return await getattr(self._provider.active, name)(*args, **kwargs)
+
+    def pipeline(self, transaction: bool = True) -> "FailoverPipeline":
+        return FailoverPipeline(self._provider, transaction)
+
+
+class FailoverPipeline:
+    """Records queued commands so they can be replayed on the fallback store if Redis fails at execute()."""
+
+    def __init__(self, provider: "RedisProvider", transaction: bool = True):
+        self._provider = provider
+        self._transaction = transaction
+        self._commands = []
+
+    def __getattr__(self, name: str):
+        def queue(*args, **kwargs):
+            self._commands.append((name, args, kwargs))
+            return self
+        return queue
+
+    async def _run(self, store, commands) -> list:
+        async with store.pipeline(transaction=self._transaction) as pipe:
+            for name, args, kwargs in commands:
+                getattr(pipe, name)(*args, **kwargs)
+            return await pipe.execute()
+
+    async def execute(self) -> list:
+        commands, self._commands = self._commands, []
+        store = self._provider.active
+        try:
+            return await self._run(store, commands)
+        except FAILOVER_ERRORS as e:
+            if store is not self._provider.redis:
+                raise
+            self._provider.fail(e)
+            return await self._run(self._provider.active, commands)
+
+    async def __aenter__(self) -> "FailoverPipeline":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._commands = []
+
+
+class RedisProvider:
+    """Owns the app-lifetime Redis pool and falls back to MemoryRedis while Redis is unreachable.
+
+    `client` is a FailoverRedis handle that stays valid across fail-overs; a background probe switches back
+    once Redis answers again. Data written to the fallback meanwhile stays in this process.
+    """
+
+    def __init__(self, url: str, settings: Optional[RedisSettings] = None):
+        self.url = url
+        self.settings = settings or RedisSettings.from_env()
+        self.pool: Optional[redis.BlockingConnectionPool] = None
+        self.redis: Optional[redis.Redis] = None
+        self.fallback: Optional[MemoryRedis] = None
+        self.active = None
+        self.client = FailoverRedis(self)
+        self._probe_task: Optional[asyncio.Task] = None
+
+    @property
+    def mode(self) -> str:
+        if self.active is None:
+            return "disconnected"
+        return "fallback" if self.active is self.fallback else "connected"
+
+    async def startup(self):
+        self.pool = redis.BlockingConnectionPool.from_url(
+            self.url,
+            decode_responses=True,
+            max_connections=self.settings.max_connections,
+            timeout=self.settings.pool_timeout,
+            socket_timeout=self.settings.socket_timeout,
+            socket_connect_timeout=self.settings.connect_timeout,
+            health_check_interval=self.settings.health_check_interval,
+        )
+        self.redis = InstrumentedRedis(connection_pool=self.pool)
+        await self.check()
+        self._probe_task = asyncio.create_task(self._probe())
+
+    def fail(self, error: Exception):
+        if self.fallback is None:
+            self.fallback = MemoryRedis()
+        if self.active is not self.fallback:
+            logger.warning("Redis unreachable (%s); using in-process fallback store", error)
+        self.active = self.fallback
+
+    async def check(self) -> bool:
+        try:
+            await self.redis.ping()
+            if self.active is not self.redis:
+                logger.info("Redis connected: %s", self.url)
+            self.active = self.redis
+            return True
+        except Exception as e:
+            self.fail(e)
+            return False
+
+    async def _probe(self):
+        # Requests fail over on their own; this brings the app back to Redis without an external /health poller.
+        while True:
+            await asyncio.sleep(self.settings.probe_interval)
+            if self.active is self.fallback:
+                await self.check()
+
+    async def shutdown(self):
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            await asyncio.gather(self._probe_task, return_exceptions=True)
+            self._probe_task = None
+        if self.redis is not None:
+            await self.redis.aclose()
+        if self.pool is not None:
+            await self.pool.disconnect()
+        self.active = None
@@ -0,0 +1,28 @@
+import re
+
+# Words, digit runs and single punctuation marks, roughly the units BPE tokenizers split on.
+_PIECES = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def count_tokens(text: str) -> int:
+    """Local, slightly pessimistic estimate of BPE tokens for English text; no provider call."""
+    total = 0
+    for piece in _PIECES.findall(text):
+        length = len(piece)
+        if piece[0].isdigit():
+            total += (length + 2) // 3
+        elif length <= 6:
+            total += 1
+        else:
+            total += (length + 5) // 6
+    return total
+
+
+def truncate_to_tokens(text: str, limit: int) -> str:
+    """Cut text to roughly `limit` tokens on a word boundary."""
+    tokens = count_tokens(text)
+    if tokens <= limit:
+        return text
+    cut = text[: max(1, len(text) * limit // tokens)]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > len(cut) // 2 else cut).rstrip() + " …"
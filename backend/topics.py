@@ -0,0 +1,53 @@
+import re
+import hashlib
+
+_LEAD_IN = re.compile(r'^(explain|tell|teach|show|what|how|where|when|why|can you)\s+(me\s+)?(about\s+)?')
+_COPULA = re.compile(r'^(is|are|does|do)\s+')
+# Only command-style lead-ins are dropped from request keys; a question word changes what is being asked.
+_COMMAND = re.compile(r'^((can|could) you\s+)?(please\s+)?(explain|tell|teach|show)\s+(me\s+)?(about\s+)?')
+_TRAILING_QUESTION = re.compile(r'\?+$')
+_NON_WORD = re.compile(r"[^\w\s'-]+")
+_WHITESPACE = re.compile(r'\s+')
+MAX_REQUEST_KEY = 80
+
+
+def _strip_request(raw_topic: str) -> str:
+    topic = raw_topic.lower()
+    topic = _LEAD_IN.sub('', topic)
+    topic = _COPULA.sub('', topic)
+    topic = _TRAILING_QUESTION.sub('', topic)
+    return topic.strip()
+
+
+def extract_topic(raw_topic: str) -> str:
+    topic = _strip_request(raw_topic)
+    if len(topic.split()) > 6:
+        topic = " ".join(topic.split()[:6])
+
+    if not topic or len(topic) < 3:
+        topic = raw_topic.strip()
+        if len(topic.split()) > 4:
+            topic = " ".join(topic.split()[:4])
+    return topic
+
+
+def topic_key(topic: str) -> str:
+    return topic.replace(' ', '_').lower()
+
+
+def cache_topic_key(raw_topic: str) -> str:
+    topic = _NON_WORD.sub(' ', extract_topic(raw_topic).lower())
+    return topic_key(_WHITESPACE.sub(' ', topic).strip())
+
+
+def request_key(raw_topic: str) -> str:
+    """Key for a whole request: never truncated and keeping question words, so distinct requests never share it."""
+    topic = _COMMAND.sub('', raw_topic.lower().strip())
+    topic = _TRAILING_QUESTION.sub('', topic).strip()
+    if len(topic) < 3:
+        topic = raw_topic.lower()
+    key = topic_key(_WHITESPACE.sub(' ', _NON_WORD.sub(' ', topic)).strip())
+    if len(key) > MAX_REQUEST_KEY:
+        digest = hashlib.sha1(key.encode()).hexdigest()[:16]
+        key = f"{key[:MAX_REQUEST_KEY - 17]}_{digest}"
+    return key
@@ -57,6 +57,10 @@ export default function TutoringApp() {
     
     websocket.onmessage = (event) => {
       const data = JSON.parse(event.data);
+      if (data.type === 'ping') {
+        websocket.send(JSON.stringify({ type: 'pong', ts: data.ts }));
+        return;
+      }
       console.log('Received WebSocket message:', data);
       
       if (data.type === 'message') {